@@ -0,0 +1,2 @@
+"""benchmark suite for ped, run with `python -m benchmarks --help` from the repository root, the cold start budget
+is checked with `python -m benchmarks.startup`"""
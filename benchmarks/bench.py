@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DESCRIPTION = 'run ped over generated corpora and report throughput, peak RSS and wall time as JSON'
+
+SEED = 20240229
+
+WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'ERROR:', 'WARN', 'python', 'Fred',
+         'Flintstone', 'was', 'here', 'and', 'of', 'a', 'an', 'is', 'in', 'it', 'to', '42', '1999', '3.14']
+
+UNICODE_WORDS = ['Straße', 'naïve', 'café', 'Ångström', 'ελληνικά', 'русский', '日本語', '中文', '한국어', 'עברית',
+                 'العربية', '🙂', '🚀', 'ﬁ', 'Ǆ', 'the', 'quick', 'fox', 'über', 'ÉCOLE']
+
+CASES = {
+    's': ['s/fox/cat/'],
+    's-regex': ['s/\\b(\\w)(\\w*)\\b/\\2\\1/'],
+    'S': ['S/fox\\s+jumps/leaps/'],
+    'g': ['g/lazy'],
+    'x': ['x/^the'],
+    'o': ['o/\\d+'],
+    'O': ['O/"id":\\d+'],
+    'u': ['u/quick'],
+    'U': ['U/brown \\w+'],
+    'i': ['i/10/inserted line'],
+    'y': ['y/5/3/replaced line'],
+    'd': ['d/0/1'],
+    'd-negative': ['d/-10/5'],
+    'I': ['I/100/X'],
+    'Y': ['Y/100/10/Y'],
+    'D': ['D/0/100'],
+    'chain-lines': ['s/the/THE/', 'g/THE', 'x/dog', 'u/fox', 'r/\\s+$'],
+    'chain-mixed': ['s/the/THE/', 'S/THE\\s+quick/TQ/', 'g/TQ|lazy', 'd/-1/1', 'A/end'],
+    'chain-positional': ['I/0/<', 'A/>', 'D/-10/5', 'Y/50/5/__', 'P/^'],
+}
+
+
+def short_lines(rnd, size, ending='\n'):
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 10)))
+        lines.append(line)
+        total += len(line) + len(ending)
+    return ending.join(lines) + ending
+
+
+def long_lines(rnd, size):
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(400, 1200)))
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines) + '\n'
+
+
+def single_line_json(rnd, size):
+    records = []
+    total = 0
+    while total < size:
+        record = {'id': len(records), 'name': ' '.join(rnd.choice(WORDS) for _ in range(3)),
+                  'tags': [rnd.choice(WORDS) for _ in range(rnd.randint(0, 5))], 'score': rnd.random()}
+        records.append(record)
+        total += len(json.dumps(record, separators=(',', ':'))) + 1
+    return json.dumps(records, separators=(',', ':'))
+
+
+def unicode_lines(rnd, size):
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rnd.choice(UNICODE_WORDS) for _ in range(rnd.randint(3, 10)))
+        lines.append(line)
+        total += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines) + '\n'
+
+
+CORPORA = {
+    'short': short_lines,
+    'long': long_lines,
+    'json': single_line_json,
+    'crlf': lambda rnd, size: short_lines(rnd, size, '\r\n'),
+    'unicode': unicode_lines,
+}
+
+
+def generate(name, size):
+    """the text of a corpus, always the same for a name and size"""
+    return CORPORA[name](random.Random(f'{SEED}-{name}-{size}'), size)
+
+
+def write_corpus(directory, name, size):
+    path = os.path.join(directory, f'{name}-{size}.txt')
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(generate(name, size))
+    return path
+
+
+def parse_size(value):
+    match = re.match(r'^(\d+)([kKmMgG]?)$', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid size: "{value}"')
+    return int(match[1]) << {'': 0, 'k': 10, 'm': 20, 'g': 30}[match[2].lower()]
+
+
+def peak_rss():
+    """peak resident set size of this process in bytes, ru_maxrss is in kilobytes except on macOS"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_case(argv):
+    """run ped once with its output discarded, in a fresh process so the peak RSS is this run's alone"""
+    import ped
+    stdout = sys.stdout
+    with open(os.devnull, 'w', encoding='utf-8') as devnull:
+        sys.stdout = devnull
+        try:
+            wall, cpu = time.perf_counter(), time.process_time()
+            ped.catching_main(argv)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        finally:
+            sys.stdout = stdout
+    return wall, cpu, peak_rss()
+
+
+def measure(argv, repeat):
+    """the fastest of several runs, each in its own process"""
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(run_case, argv).result())
+    wall, cpu, _ = min(runs)
+    rss = [run[2] for run in runs if run[2] is not None]
+    return wall, cpu, max(rss) if rss else None
+
+
+def run_benchmarks(args):
+    case_filter = re.compile(args.case) if args.case else None
+    corpus_filter = re.compile(args.corpus) if args.corpus else None
+    results = []
+    with tempfile.TemporaryDirectory('_ped_bench') as temp_dir:
+        directory = args.corpus_dir or temp_dir
+        os.makedirs(directory, exist_ok=True)
+        for size in args.sizes:
+            for corpus in CORPORA:
+                if corpus_filter and not corpus_filter.search(corpus):
+                    continue
+                path = write_corpus(directory, corpus, size)
+                file_size = os.path.getsize(path)
+                for case, commands in CASES.items():
+                    if case_filter and not case_filter.search(case):
+                        continue
+                    argv = ['-f', path] + args.ped_args + commands
+                    wall, cpu, rss = measure(argv, args.repeat)
+                    results.append({'corpus': corpus, 'size': size, 'bytes': file_size, 'case': case,
+                                    'commands': commands, 'wall': round(wall, 6), 'cpu': round(cpu, 6),
+                                    'mb_per_s': round(file_size / (1 << 20) / wall, 3) if wall else None,
+                                    'peak_rss': rss})
+                    if args.verbose:
+                        print(f'{corpus:>8} {size:>10} {case:>17} {wall:9.4f}s', file=sys.stderr)
+    return results
+
+
+def compare(results, baseline):
+    """print how much faster (>1) or slower (<1) each case is than in a previous report"""
+    previous = {(r['corpus'], r['size'], r['case']): r for r in baseline['results']}
+    for result in results:
+        old = previous.get((result['corpus'], result['size'], result['case']))
+        if old and result['wall']:
+            print(f"{result['corpus']:>8} {result['size']:>10} {result['case']:>17} "
+                  f"{old['wall'] / result['wall']:6.2f}x", file=sys.stderr)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('--sizes', type=lambda value: [parse_size(size) for size in value.split(',')],
+                        default=[1 << 20, 8 << 20], help='comma separated corpus sizes, e.g. 64K,1M (default: 1M,8M)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest is reported')
+    parser.add_argument('--case', metavar='REGEX', help='only run the cases matching REGEX')
+    parser.add_argument('--corpus', metavar='REGEX', help='only use the corpora matching REGEX')
+    parser.add_argument('--corpus-dir', metavar='DIR', help='keep the generated corpora in DIR and reuse them')
+    parser.add_argument('--ped-arg', dest='ped_args', metavar='ARG', action='append', default=[],
+                        help='extra option passed to ped for every case, e.g. --ped-arg=-j0')
+    parser.add_argument('--baseline', metavar='JSON', help='a previous report to compare the wall times with')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write the report to FILE instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print each result to stderr as it completes')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+              'results': results}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+DESCRIPTION = 'measure the cold start of ped against a bare python and fail when it is over the budget'
+
+PED_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ped.py')
+
+# modules only some options need, ped imports them where they are used
+DEFERRED_MODULES = ['concurrent.futures', 'dataclasses', 'datetime', 'glob', 'inspect', 'json', 'shutil', 'typing']
+
+IMPORT_BUDGET_MS = 25.0
+
+# time a cold run may take over starting a bare python
+COLD_BUDGET_MS = 25.0
+
+
+def parse_importtime(output):
+    """(module, self µs, cumulative µs) for each line of `python -X importtime` output"""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def get_env(cache_dir):
+    """bytecode is cached in cache_dir so only the first run pays for compiling ped"""
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+    env['PYTHONPYCACHEPREFIX'] = cache_dir
+    return env
+
+
+def get_imports(argv, env=None, text='abc\n'):
+    """the modules imported by one run of the ped command line"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', PED_PATH] + argv, input=text, env=env,
+                            capture_output=True, text=True, check=True)
+    return parse_importtime(result.stderr)
+
+
+def best_time(command, env, repeat):
+    """the fastest wall time of several runs in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(args):
+    with tempfile.TemporaryDirectory('_ped_startup') as temp_dir:
+        env = get_env(temp_dir)
+        path = os.path.join(temp_dir, 'tiny.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('the quick brown fox\n')
+        importer = [sys.executable, '-c', f'import sys; sys.path.insert(0, {os.path.dirname(PED_PATH)!r}); import ped']
+        subprocess.run(importer, env=env, check=True)
+        result = subprocess.run(importer[:1] + ['-X', 'importtime'] + importer[1:], env=env, capture_output=True,
+                                text=True, check=True)
+        import_us = next(cumulative for name, _, cumulative in parse_importtime(result.stderr) if name == 'ped')
+        imported = [name for name, _, _ in get_imports(['-f', path] + args.ped_args + args.commands, env)]
+        bare = best_time([sys.executable, '-c', 'pass'], env, args.repeat)
+        argv = ['-f', path] + args.ped_args + args.commands
+        cold = best_time([sys.executable, PED_PATH] + argv, env, args.repeat)
+        baseline = best_time([sys.executable, args.baseline] + argv, env, args.repeat) if args.baseline else None
+    deferred = [name for name in DEFERRED_MODULES if name in imported]
+    ok = not deferred and import_us / 1000 <= args.budget and (cold - bare) * 1000 <= args.cold_budget
+    return {'python': sys.version.split()[0], 'import_ms': round(import_us / 1000, 3),
+            'budget_ms': args.budget, 'bare_python_ms': round(bare * 1000, 3), 'cold_run_ms': round(cold * 1000, 3),
+            'cold_budget_ms': args.cold_budget,
+            'baseline_run_ms': None if baseline is None else round(baseline * 1000, 3),
+            'modules': len(imported), 'deferred_imported': deferred,
+            'ok': ok and (baseline is None or cold <= baseline)}
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('commands', metavar='COMMAND', nargs='*', default=['s/fox/cat/'],
+                        help='ped commands of the cold run (default: s/fox/cat/)')
+    parser.add_argument('--budget', metavar='MS', type=float, default=IMPORT_BUDGET_MS,
+                        help=f'maximum time to import ped in milliseconds (default: {IMPORT_BUDGET_MS})')
+    parser.add_argument('--cold-budget', metavar='MS', type=float, default=COLD_BUDGET_MS,
+                        help='maximum time a cold run of `python ped.py` may take over a bare python in '
+                             f'milliseconds (default: {COLD_BUDGET_MS})')
+    parser.add_argument('--baseline', metavar='FILE', default=None,
+                        help='the ped.py of another version, e.g. the last release, a cold run may not be slower')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of each command, the fastest is reported')
+    parser.add_argument('--ped-arg', dest='ped_args', metavar='ARG', action='append', default=[],
+                        help='extra option passed to ped, e.g. --ped-arg=-i')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    report = measure(parse_args(argv))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,2965 @@
+import argparse
+import array
+import codecs
+import collections
+import errno
+import functools
+import io
+import itertools
+import mmap
+import os
+import re
+import stat
+import sys
+import time
+from enum import IntEnum
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+LINE_SUB = 's'
+FILE_SUB = 'S'
+LINE_FIXED_SUB = 'f'
+FILTER = 'g'
+LINE_FILTER = 'G'
+EXCLUDE = 'x'
+LINE_EXCLUDE = 'X'
+LINE_ONLY = 'o'
+FILE_ONLY = 'O'
+LINE_REMOVE = 'r'
+FILE_REMOVE = 'R'
+LINE_UPPER = 'u'
+FILE_UPPER = 'U'
+LINE_LOWER = 'l'
+FILE_LOWER = 'L'
+LINE_TITLE = 't'
+FILE_TITLE = 'T'
+LINE_CAPITALIZE = 'c'
+FILE_CAPITALIZE = 'C'
+LINE_PREPEND = 'p'
+FILE_PREPEND = 'P'
+LINE_APPEND = 'a'
+FILE_APPEND = 'A'
+LINE_INSERT = 'i'
+FILE_INSERT = 'I'
+LINE_REPLACE = 'y'
+FILE_REPLACE = 'Y'
+LINE_DELETE = 'd'
+FILE_DELETE = 'D'
+POSITIONAL_LINE_COMMANDS = [LINE_APPEND, LINE_PREPEND, LINE_INSERT, LINE_REPLACE, LINE_DELETE]
+ALL_FILTERS = [FILTER, LINE_FILTER, EXCLUDE, LINE_EXCLUDE, LINE_ONLY, LINE_REMOVE]
+
+ANSI_BLACK = '\u001b[30m'
+ANSI_RED = '\u001b[31m'
+ANSI_GREEN = '\u001b[32m'
+ANSI_YELLOW = '\u001b[33m'
+ANSI_BLUE = '\u001b[34m'
+ANSI_MAGENTA = '\u001b[35m'
+ANSI_CYAN = '\u001b[36m'
+ANSI_WHITE = '\u001b[37m'
+ANSI_RESET = '\u001b[0m'
+ANSI_BOLD = '\u001b[1m'
+ANSI_UNDERLINE = '\u001b[4m'
+ANSI_REVERSE = '\u001b[7m'
+
+EPILOG = '''
+<mark-over>Commands:
+
+    s - regexp substitution within lines
+    S - regexp substitution across lines, regexp match can span lines† 
+    f - fixed string substitution within lines (shorthand for `s` & -F)
+    g - [grep] regexp filter lines, keep only lines with one more more matches
+    G - regexp filter lines, keep only lines that completely match
+    x - [exclude] regexp filter lines, keep only lines WITHOUT one more more matches
+    X - regexp filter lines, keep only lines that DO NOT completely match
+    o - [only] regexp filter lines keeping only the matching parts of lines
+    O - Only keep part(s) of the file that matches the regexp†
+    r - regexp filter lines removing only the matching parts of lines
+    R - Only remove part(s) of the file that matches the regexp†
+    l - transform match to lower case by line
+    L - transform match to lower case across lines†
+    u - transform match to upper case by line
+    U - transform match to upper case across lines†
+    t - transform match to title case by line
+    T - transform match to title case across lines¹
+    c - transform match to a capitalized sentence by line
+    C - transform match to a capitalized sentence across lines†
+    a - append lines
+    A - append characters
+    p - prepend lines
+    P - prepend characters
+    i - insert by line number 'i/<pos>/str/' 1: after the first line, -1: before the last line
+    I - insert at character position  'I/<pos>/str/' 1: after the first char, -1: before the last char
+    y - replace lines 'y/<pos>/<count>/str/'
+    Y - replace characters 'y/<pos>/<count>/str/'
+    d - delete lines by line number and count
+    D - delete characters by position and count
+
+Commands are processed in the order they appear, usually
+consisting of a one character operation code and parameters
+delimited by a slash or other punctuation, for example:
+
+  s/this/that/
+
+would invoke the `s` for substitution operation which would replace
+all occurrences of `this` with `that`. The first parameter is a
+regular expression and the second is the replacement string. Though
+similar to the venerable sed command, the regular expressions are
+python compatible, see: https://tinyurl.com/py3-re-syntax . 
+
+Delimiters can be any punctuation character so no meta-escaping is needed,
+for example to change all slashes to underscores you could use:
+
+  s:/:_:
+
+Also, the trailing delimiter is optional, the following is identical to 
+the preceding:
+
+  s:/:_
+
+Use of single quotes is recommended to avoid shell pattern and meta-character  
+issues:
+
+  $> ped -f input 's:$:_'
+
+The substitution command with a uppercase `S` can use patterns that span lines, 
+so if you wanted to change Fred Flintstone to Barney Rubble even if Fred was 
+at the end of one line and Flintstone was at the beginning of the next you might
+use:
+
+  $> ped -f story.txt 'S/Fred(\\s+)Flintstone/Barney\\1Rubble'
+
+Explanations: \\s matches any white space character, \\s+ matches one or more
+whitespace, e.g. a space at the end of the line AND the line ending character(s)
+AND any indentation on the next line. Using \\1 in the replacement preserves whatever
+whitespace existed between Fred and Flintstone.
+
+Cross-line commands normally need the whole input in memory, for huge input the --window
+option applies them to a sliding window of lines instead. Text is only written once no match
+attempt starting in it could still be running at the end of the window, a match attempt that
+outgrows the whole window is reported as an error rather than being silently cut short:
+
+  $> ped -f huge-story.txt --window 1000 'S/Fred(\\s+)Flintstone/Barney\\1Rubble'
+
+The fixed `f` command is shorthand for `s` with the --fixed or -F option. The pattern
+is treated as a literal string, not a regular expression. All of these examples are
+equivalent:
+
+  $> ped -f story.txt 'f/./!/'
+  $> ped -f story.txt --fixed 's/./!/'
+  $> ped -f story.txt 's/\\./!/'
+
+Filtering
+
+The `g`, `G`, `x`, `X`, `o` filter text line by line:
+
+  `g` - keep only lines that have a match anywhere on the line (like egrep)
+  `G` - keep only lines that completely match (excluding the line endings \\n and/or \\r) (like egrep -x)
+  `x` - keep only lines that DON'T have a match anywhere on the line (like egrep -v)
+  `X` - keep only lines that DON'T completely match (excluding the line endings \\n and/or \\r) (like egrep -v -x)
+  `o` - keep only the part(s) of lines that match, lines with no match are eliminated. (like egrep -o²)
+
+Removing matches 
+
+`r` will remove matches within a line, `R` will remove matches even if patterns span lines. These 
+commands are shorthand for for `s` and `S` with an empty replacement string.
+
+Case changing commands
+
+`l`, `L`, `u`, `U`, `t`, `T`, `c`, `C` replace matches with a lowercase, uppercase, title case 
+and capitalized sentence transformation of the matched text. The upper case versions 
+can match text across lines. Consult official python documentation for the technical 
+specification for each of these operations. See: https://docs.python.org/3/library/stdtypes.html#string-methods
+
+  $> ped -f story.txt -i 'U/fred\\s+flintstone/'
+
+Appending & Prepending
+
+`a`, `p` are used to append and prepend a line³ based on the POSIX definition⁴ of lines.
+`A`, `P` are used to append and prepend characters to the input without regard to lines
+
+  $> ped -f shopping-list.txt 'a/eggs/'
+
+Line number operations
+
+`i`, `y`, `d` are used to insert, replace and delete lines by line number, negative values index from 
+the last line up. 0 positions before the first line, 1 positions after the first line, -1 positions
+before the last line. For the case of replace and delete the number of lines are specified with a second 
+numeric parameter. Replace `y` takes a third parameter of text to use for the replacement as literal text
+without any escaping supported or required. positions and/or counts are clamped to the range of data.
+
+  $> ped -f shopping-list.txt 'i/0/avocados/'   # same as prepend
+  $> ped -f shopping-list.txt 'i/1/eggs/'       # eggs are inserted as the second line
+  $> ped -f shopping-list.txt 'y/2/3/eggs'      # eggs replace the 3rd, 4th and 5th items on the list
+  $> ped -f shopping-list.txt 'y/-2/2/eggs'     # eggs replace the last two items on the list
+  $> ped -f shopping-list.txt 'd/5/1'           # delete 6th line
+  $> ped -f shopping-list.txt 'd/-2/2'          # delete last two lines
+
+¹ you will often want to use the --dotall option so that a dot `.` will match any
+character including line separators like \\r and \\n.
+
+² there is a subtle difference, egrep -o will create multiple lines of output for multiple matches on
+the same line
+
+³ embedded line termination characters will effectively append multiple lines
+
+⁴ POSIX defines a line as including a line ending character so a empty input (file) is considered to have zero lines 
+'''.strip()
+
+# ¹²³⁴⁵⁶⁷⁸⁹⁰
+
+CHUNK_SIZE = 8 << 20
+BLOCK_SIZE = 1 << 16
+# hits of a guard closer than this are substituted together, starting the regular expression engine costs
+# about as much as it takes to scan this many characters
+GUARD_GAP = 256
+
+META_CHARS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+LITERAL_EXACT = 'exact'
+LITERAL_FOLDED = 'folded'
+OTHER_SEPARATORS = '\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+DESCRIPTION = 'make edit to text file, line endings will be normalized to the os convention'
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.serve:
+        return serve(args.serve)
+    if args.connect:
+        return connect(args.connect, argv)
+    return dispatch(args)
+
+
+def dispatch(args):
+    if args.restore:
+        return restore(args)
+    if args.list_backups:
+        return list_backups(args)
+    run(args)
+
+
+def run(args):
+    script = Script(args, compile_commands(args))
+    script.edit_files(get_paths(args), sys.stdout)
+    if args.inplace:
+        prune_backups(args)
+    if args.profiler is not None:
+        args.profiler.report(sys.stderr, args.profile)
+
+
+def compile(commands, **options):
+    # options are named after the long command line options, e.g. compile(['s/a/b/'], ignore_case=True)
+    parser = get_parser()
+    actions = {name[2:].replace('-', '_'): action for action in parser._actions if action.dest != 'help'
+               for name in action.option_strings if name.startswith('--')}
+    args = parser.parse_args([])
+    for name, value in options.items():
+        action = actions.get(name)
+        if action is None:
+            raise TypeError(f'compile() got an unexpected option: "{name}"')
+        try:
+            if action.nargs == 0:
+                value = action.const if value else action.default
+            elif action.type is not None and value != action.default:
+                value = action.type(value)
+        except (ValueError, argparse.ArgumentTypeError) as ex:
+            raise PedError(f'Error: invalid {name} option - "{value}"', PedErrorTypes.PED_OTHER_ERROR) from ex
+        if action.choices is not None and value not in action.choices:
+            raise PedError(f'Error: invalid {name} option - "{value}"', PedErrorTypes.PED_OTHER_ERROR)
+        setattr(args, action.dest, value)
+    args.commands = [commands] if isinstance(commands, str) else list(commands)
+    args = init_args(args)
+    try:
+        return Script(args, compile_commands(args))
+    except PedError:
+        raise
+    except Exception as ex:
+        raise get_ped_error(ex) from ex
+
+
+class Script:
+
+    def __init__(self, args: argparse.Namespace, commands):
+        self.args = args
+        self.commands = commands
+        self.segments = plan(args, commands)
+
+    def apply(self, text: str) -> str:
+        # line endings follow the line_ending and no_eof options
+        args = self.args
+        if can_prescan(args, self.commands) and is_unchanged(args, self.commands, text):
+            return text
+        output = run_segments(args, self.segments, normalize_input(args, self.segments, text))
+        if isinstance(output, str):
+            return output
+        stream = io.StringIO()
+        write_output(args, output, stream)
+        return stream.getvalue()
+
+    def apply_lines(self, lines):
+        # lines are given and yielded without line endings
+        args = self.args
+        data = get_normalized_lines(args, list(lines)) if args.normalize else iter(lines)
+        return iter(as_line_stream(args, run_segments(args, self.segments, data)))
+
+    def apply_file(self, path, inplace=False):
+        # edited in place it returns whether the file changed, leaving a backup
+        args = argparse.Namespace(**{**vars(self.args), 'inplace': inplace})
+        try:
+            if inplace:
+                return edit(args, self.commands, path, None)
+            return edit_to_string(args, self.commands, path)
+        except PedError:
+            raise
+        except Exception as ex:
+            raise get_ped_error(ex) from ex
+
+    def edit_files(self, paths, stream):
+        args, commands = self.args, self.commands
+        if len(paths) == 1 and args.jobs != 1 and can_split(args, commands, paths[0]):
+            edit_chunked(args, commands, paths[0], stream)
+        elif len(paths) == 1:
+            edit(args, commands, paths[0], stream)
+        elif args.jobs == 1:
+            for path in paths:
+                edit(args, commands, path, stream)
+        else:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None) as executor:
+                for output in executor.map(functools.partial(edit_to_string, args, commands), paths):
+                    stream.write(output)
+
+
+def edit(args, commands, path, stream):
+    args = argparse.Namespace(**{**vars(args), 'path': path})
+    profiler = args.profiler
+    if args.path != '-' and can_prescan(args, commands):
+        if profiler is not None:
+            contents = profiler.call(profiler.stage('(prescan)'), prescan, args, commands)
+        else:
+            contents = prescan(args, commands)
+        if contents is not None:
+            return write_unchanged(args, contents, stream)
+
+    mapped = can_map(args, commands)
+    segments = plan(args, commands[1:] if mapped else commands)
+
+    if mapped:
+        output = ByteChunks(iter_mapped(args, commands[0]))
+        if profiler is not None:
+            output = ByteChunks(profiler.stream(profiler.command_stage(commands[0]), output, text=True))
+        output = TextChunks(iter_decoded(output)) if segments else output
+    elif not segments or not segments[0][0]:
+        if profiler is not None:
+            contents = profiler.call(profiler.stage('(read)'), read_input, args)
+        else:
+            contents = read_input(args)
+        output = normalize_input(args, segments, contents)
+    else:
+        output = get_input_stream(args, segments[0][1][0])
+        if profiler is not None:
+            output = profiler.stream_input(output)
+
+    output = run_segments(args, segments, output)
+    write = write_output if profiler is None else functools.partial(profiler.call, profiler.stage('(write)'),
+                                                                     write_output)
+
+    if args.inplace and args.path != '-':
+        changed = write_in_place(args, output, write)
+        if args.status:
+            print(f'{"changed" if changed else "unchanged"} {args.path}', file=sys.stderr)
+        return changed
+    write(args, output, stream)
+
+
+def write_unchanged(args, contents, stream):
+    # the prescan found the commands cannot change the input
+    if args.inplace:
+        get_writable_path(args)
+        if args.status:
+            print(f'unchanged {args.path}', file=sys.stderr)
+        return False
+    write_output(args, ByteChunks([contents]), stream)
+
+
+def get_writable_path(args):
+    path = os.path.realpath(args.path)
+    if not os.access(path, os.W_OK):
+        raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), args.path)
+    return path
+
+
+def write_in_place(args, output, write):
+    # the input is either the original or the complete output, the backup is a hard link to the original if possible
+    path = get_writable_path(args)
+    store = get_backup_store(args)
+    original = os.stat(path)
+    with ChangedFile(path) as changed:
+        f = io.TextIOWrapper(io.BufferedWriter(changed, BLOCK_SIZE), encoding='utf-8')
+        write(args, output, f)
+        f.flush()
+        f.detach().detach()  # the wrappers would close the file when collected
+        if not changed.finish():
+            return False
+        os.fsync(changed.file.fileno())
+        os.chmod(changed.temp_path, stat.S_IMODE(original.st_mode))
+        try:
+            os.chown(changed.temp_path, original.st_uid, original.st_gid)
+        except OSError:
+            pass  # only the owner's group or root can keep another owner
+        store.add(path)
+        os.replace(changed.temp_path, path)
+        changed.temp_path = None
+    return True
+
+
+class ChangedFile(io.RawIOBase):
+    # a temporary file beside the original is only created at the first difference
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.original = open(path, 'rb')
+        self.size = 0
+        self.file = None
+        self.temp_path = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.file is None:
+            if self.original.read(len(data)) == data:
+                self.size += len(data)
+                return len(data)
+            self.start()
+        self.file.write(data)
+        return len(data)
+
+    def start(self):
+        import tempfile
+        fd, self.temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(self.path)}.', suffix='.ped',
+                                              dir=os.path.dirname(self.path))
+        self.file = open(fd, 'wb')
+        self.original.seek(0)
+        remaining = self.size
+        while remaining and (data := self.original.read(min(remaining, BLOCK_SIZE))):
+            self.file.write(data)
+            remaining -= len(data)
+
+    def finish(self):
+        # the written output is only a prefix of the original when it is shorter
+        if self.file is None and self.original.read(1):
+            self.start()
+        if self.file is not None:
+            self.file.flush()
+        return self.file is not None
+
+    def close(self):
+        if not self.closed:
+            self.original.close()
+            if self.file is not None:
+                self.file.close()
+            if self.temp_path is not None:
+                os.unlink(self.temp_path)
+                self.temp_path = None
+        super().close()
+
+
+def get_backup_store(args):
+    raw_dir = args.backup_dir[0] if isinstance(args.backup_dir, list) else args.backup_dir
+    backup_dir = os.path.expanduser(raw_dir)
+    if not os.path.isdir(backup_dir):
+        os.makedirs(backup_dir, exist_ok=True)
+    if not os.path.isdir(backup_dir):
+        raise PedError(f'Backup dir does not exist: {backup_dir}', PedErrorTypes.PED_IO_ERROR)
+    return BackupStore(backup_dir, args.backup_compression)
+
+
+BACKUP_SUFFIXES = {'zlib': '.z', 'lzma': '.xz', 'none': ''}
+
+
+class BackupStore:
+    # backups kept once per content, compressed and named by its sha256, with an index of JSON lines
+
+    def __init__(self, directory, compression='zlib'):
+        self.directory = directory
+        self.compression = compression
+        self.index_path = os.path.join(directory, 'index.jsonl')
+
+    def get_blob_path(self, blob):
+        return os.path.join(self.directory, 'objects', blob[:2], blob[2:])
+
+    def find_blob(self, digest):
+        for suffix in BACKUP_SUFFIXES.values():
+            if os.path.exists(self.get_blob_path(digest + suffix)):
+                return digest + suffix
+        return None
+
+    def add(self, path):
+        import hashlib
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while data := f.read(BLOCK_SIZE << 4):
+                digest.update(data)
+        os.makedirs(self.directory, exist_ok=True)
+        with self.locked():
+            blob = self.find_blob(digest.hexdigest())
+            if blob is None:
+                blob = digest.hexdigest() + BACKUP_SUFFIXES[self.compression]
+                self.write_blob(path, blob)
+            entry = {'path': os.path.realpath(path), 'time': time.time(), 'blob': blob, 'size': os.path.getsize(path)}
+            import json
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def write_blob(self, path, blob):
+        # without compression the original is hard linked
+        import tempfile
+        blob_path = self.get_blob_path(blob)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        if self.compression == 'none':
+            try:
+                os.link(path, blob_path)
+                return
+            except OSError:
+                pass  # another file system, copied below
+        fd, temp_path = tempfile.mkstemp(prefix='.blob.', dir=os.path.dirname(blob_path))
+        try:
+            with open(fd, 'wb') as blob_file, open(path, 'rb') as source:
+                compressor = get_compressor(self.compression)
+                while data := source.read(BLOCK_SIZE << 4):
+                    blob_file.write(compressor.compress(data) if compressor else data)
+                if compressor:
+                    blob_file.write(compressor.flush())
+            os.replace(temp_path, blob_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def iter_blob(self, entry):
+        decompressor = get_decompressor(entry['blob'])
+        with open(self.get_blob_path(entry['blob']), 'rb') as f:
+            while data := f.read(BLOCK_SIZE << 4):
+                yield decompressor.decompress(data) if decompressor else data
+
+    def get_entries(self):
+        import json
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                pass  # a line cut short by a crash
+        return entries
+
+    def find(self, path, before=None):
+        # the latest backup of a path, or the latest at or before a time
+        path = os.path.realpath(path)
+        found = [entry for entry in self.get_entries()
+                 if entry['path'] == path and (before is None or entry['time'] <= before)]
+        return max(found, key=lambda entry: entry['time'], default=None)
+
+    def prune(self, max_age=None, max_size=None, keep=None):
+        # by age and count per path first, then the oldest until the blobs fit max_size, returns the number dropped
+        with self.locked():
+            entries = sorted(self.get_entries(), key=lambda entry: entry['time'], reverse=True)
+            now = time.time()
+            counts = collections.Counter()
+            kept = []
+            for entry in entries:
+                if (keep is not None and counts[entry['path']] >= keep) or \
+                        (max_age is not None and now - entry['time'] > max_age):
+                    continue
+                counts[entry['path']] += 1
+                kept.append(entry)
+            if max_size is not None:
+                sizes = {}
+                for n, entry in enumerate(kept):
+                    if entry['blob'] not in sizes:
+                        sizes[entry['blob']] = os.path.getsize(self.get_blob_path(entry['blob']))
+                    if sum(sizes.values()) > max_size:
+                        kept = kept[:n]
+                        break
+            if len(kept) < len(entries):
+                self.write_index(reversed(kept))
+                self.delete_unused({entry['blob'] for entry in kept})
+        return len(entries) - len(kept)
+
+    def write_index(self, entries):
+        import json
+        import tempfile
+        fd, temp_path = tempfile.mkstemp(prefix='.index.', dir=self.directory)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        os.replace(temp_path, self.index_path)
+
+    def delete_unused(self, used):
+        objects = os.path.join(self.directory, 'objects')
+        for prefix in os.listdir(objects) if os.path.isdir(objects) else []:
+            for name in os.listdir(os.path.join(objects, prefix)):
+                if not name.startswith('.') and prefix + name not in used:
+                    os.unlink(os.path.join(objects, prefix, name))
+
+    def locked(self):
+        return FileLock(os.path.join(self.directory, 'index.lock'))
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        except ImportError:
+            pass  # Windows, backups are not made concurrently there without --jobs
+        return self
+
+    def __exit__(self, *_exc):
+        os.close(self.fd)
+
+
+def get_compressor(compression):
+    if compression == 'zlib':
+        import zlib
+        return zlib.compressobj()
+    if compression == 'lzma':
+        import lzma
+        return lzma.LZMACompressor()
+    return None
+
+
+def get_decompressor(blob):
+    if blob.endswith(BACKUP_SUFFIXES['zlib']):
+        import zlib
+        return zlib.decompressobj()
+    if blob.endswith(BACKUP_SUFFIXES['lzma']):
+        import lzma
+        return lzma.LZMADecompressor()
+    return None
+
+
+def prune_backups(args):
+    if args.backup_keep is None and args.backup_max_age is None and args.backup_max_size is None:
+        return 0
+    max_age = None if args.backup_max_age is None else args.backup_max_age * 86400
+    return get_backup_store(args).prune(max_age, args.backup_max_size, args.backup_keep)
+
+
+def restore(args):
+    # the content replaced is backed up in turn
+    store = get_backup_store(args)
+    before = None
+    if args.backup_time:
+        import datetime
+        before = datetime.datetime.fromisoformat(args.backup_time).timestamp()
+    entry = store.find(args.restore, before)
+    if entry is None:
+        raise PedError(f'Error: no backup of "{args.restore}"', PedErrorTypes.PED_IO_ERROR)
+    args = argparse.Namespace(**{**vars(args), 'path': args.restore})
+    output = ByteChunks(store.iter_blob(entry))
+    if os.path.exists(args.restore):
+        changed = write_in_place(args, output, write_output)
+    else:
+        with open(args.restore, 'wb') as f:
+            f.writelines(output)
+        changed = True
+    if args.status:
+        print(f'{"changed" if changed else "unchanged"} {args.restore}', file=sys.stderr)
+    prune_backups(args)
+
+
+def list_backups(args):
+    import datetime
+    path = os.path.realpath(args.list_backups)
+    for entry in get_backup_store(args).get_entries():
+        if entry['path'] == path:
+            when = datetime.datetime.fromtimestamp(entry['time']).isoformat(timespec='seconds')
+            print(f"{when}  {entry['size']:>10}  {entry['blob']}")
+
+
+def normalize_input(args, segments, contents):
+    # a leading buffered segment is given both the joined and the split form
+    if not args.normalize:
+        return contents
+    lines = get_lines(args, contents)
+    document = Document(lines)
+    if lines and not lines[-1] and not args.eof:
+        # with -Z the trailing empty line is lost when the lines are joined, so they are not kept
+        return document.get_string(args)
+    return document if segments and not segments[0][0] else document.get_string(args)
+
+
+def edit_to_string(args, commands, path):
+    # output is returned so it can be written in input order
+    stream = io.StringIO()
+    edit(args, commands, path, stream)
+    return stream.getvalue()
+
+
+def can_split(args, commands, path):
+    # every command must work on each line independently, -M needs a count across the whole file
+    if path == '-' or args.inplace or args.maxsub > 0 or not commands:
+        return False
+    if not all(cmd.op in LINE_STAGES and cmd.op not in POSITIONAL_LINE_COMMANDS for cmd in commands):
+        return False
+    return os.path.getsize(path) > CHUNK_SIZE
+
+
+def iter_chunk_ranges(path, size):
+    # byte ranges of roughly size bytes that each end with a complete line
+    with open(path, 'rb') as f:
+        total = os.fstat(f.fileno()).st_size
+        start = 0
+        while start < total:
+            f.seek(min(start + size, total))
+            f.readline()
+            end = f.tell()
+            yield start, end
+            start = end
+
+
+def edit_chunk(args, commands, path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    if args.normalize and not args.eof:
+        text = get_string(args, text.splitlines())
+    lines = chain_line_stages(args, text, commands)
+    ending = args.ending
+    return ''.join([line + ending for line in lines])
+
+
+def edit_chunked(args, commands, path, stream):
+    contents = prescan(argparse.Namespace(**{**vars(args), 'path': path}), commands) \
+        if can_prescan(args, commands) else None
+    if contents is not None:
+        return write_unchanged(args, contents, stream)
+    starts, ends = zip(*iter_chunk_ranges(path, CHUNK_SIZE))
+    ending = args.ending
+    pending = ''
+    import concurrent.futures
+    # with -Z only the last chunk ends where the text does
+    chunk_args = [argparse.Namespace(**{**vars(args), 'eof': True})] * (len(starts) - 1) + [args]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs or None) as executor:
+        for output in executor.map(edit_chunk, chunk_args, itertools.repeat(commands), itertools.repeat(path),
+                                   starts, ends):
+            if output:
+                stream.write(pending + output[:len(output) - len(ending)])
+                pending = ending
+    if args.eof:
+        stream.write(pending)
+
+
+def serve(path):
+    # the imports and the compiled patterns are reused across the forwarded command lines
+    import signal
+    import socket
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(path) == 0:
+                raise PedError(f'Error: a server is already listening on "{path}"', PedErrorTypes.PED_IO_ERROR)
+        os.unlink(path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        try:
+            server.listen()
+            while True:
+                connection, _ = server.accept()
+                with connection:
+                    try:
+                        serve_connection(connection)
+                    except Exception as ex:  # one bad request must not stop the server
+                        reply_error(connection, ex)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(path)
+    return 0
+
+
+def serve_connection(connection):
+    # a request is a JSON line with the argv and cwd followed by stdin, the reply is a series of frames
+    import json
+    reader = connection.makefile('rb')
+    line = reader.readline()
+    if not line:
+        return
+    request = json.loads(line)
+    stdout = io.TextIOWrapper(io.BufferedWriter(FrameWriter(connection, b'o'), BLOCK_SIZE), encoding='utf-8',
+                              newline='\n')
+    stderr = io.TextIOWrapper(FrameWriter(connection, b'e'), encoding='utf-8', newline='\n', write_through=True)
+    streams, cwd = (sys.stdin, sys.stdout, sys.stderr), os.getcwd()
+    sys.stdin = io.TextIOWrapper(reader, encoding='utf-8', newline='\n')
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        os.chdir(request['cwd'])
+        rc = run_request(request['argv'])
+        stdout.flush()
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
+        os.chdir(cwd)
+    FrameWriter(connection, b'x').write(str(rc).encode('ascii'))
+
+
+def run_request(argv):
+    try:
+        args = parse_args(argv)
+    except SystemExit as ex:  # argparse for --help or invalid options
+        return ex.code if isinstance(ex.code, int) else int(ex.code is not None)
+    try:
+        if args.serve:
+            raise PedError('Error: --serve cannot be forwarded to a server', PedErrorTypes.PED_OTHER_ERROR)
+        return dispatch(args) or 0
+    except Exception as ex:
+        pex = ex if isinstance(ex, PedError) else get_ped_error(ex)
+        print(pex.msg, file=sys.stderr)
+        return int(pex.type)
+
+
+def reply_error(connection, ex):
+    pex = ex if isinstance(ex, PedError) else get_ped_error(ex)
+    try:
+        FrameWriter(connection, b'e').write(f'{pex.msg}\n'.encode('utf-8'))
+        FrameWriter(connection, b'x').write(str(int(pex.type)).encode('ascii'))
+    except OSError:
+        pass  # the client went away
+
+
+class FrameWriter(io.RawIOBase):
+    # frames of a one byte channel, a length and the data
+
+    def __init__(self, connection, channel):
+        super().__init__()
+        self.connection = connection
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.connection.sendall(self.channel + len(data).to_bytes(4, 'big') + bytes(data))
+        return len(data)
+
+
+def connect(path, argv):
+    # stdin is not forwarded when it is a terminal, the exit code is the server's
+    import json
+    import select
+    import socket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.setblocking(False)
+        pending = json.dumps({'argv': argv, 'cwd': os.getcwd()}).encode('utf-8') + b'\n'
+        stdin = None if sys.stdin is None or sys.stdin.isatty() else sys.stdin.fileno()
+        received = bytearray()
+        while True:
+            readers = [client] if pending or stdin is None else [client, stdin]
+            readable, writable, _ = select.select(readers, [client] if pending else [], [])
+            if stdin in readable:
+                pending = os.read(stdin, BLOCK_SIZE)
+                if not pending:
+                    stdin = None
+                    client.shutdown(socket.SHUT_WR)
+            elif writable:
+                pending = pending[client.send(pending):]
+                if not pending and stdin is None:
+                    client.shutdown(socket.SHUT_WR)
+            if client in readable:
+                data = client.recv(BLOCK_SIZE)
+                if not data:
+                    raise PedError(f'Error: the server on "{path}" closed the connection', PedErrorTypes.PED_IO_ERROR)
+                received += data
+                while len(received) >= 5 and len(received) >= 5 + (size := int.from_bytes(received[1:5], 'big')):
+                    channel, data = received[:1], bytes(received[5:5 + size])
+                    del received[:5 + size]
+                    if channel == b'x':
+                        return int(data)
+                    stream = sys.stdout if channel == b'o' else sys.stderr
+                    stream.flush()
+                    stream.buffer.write(data)
+                    stream.buffer.flush()
+
+
+def get_paths(args):
+    paths = []
+    for path in args.paths or []:
+        matches = sorted(iter_glob(path)) if any(c in path for c in '*?[') else []
+        paths.extend(matches or [path])
+    if args.files_from:
+        listing = sys.stdin.read() if args.files_from == '-' else get_file_contents(args.files_from)
+        paths.extend(name for name in listing.split('\0' if '\0' in listing else '\n') if name)
+    if args.files_from is None and not paths:
+        paths = ['-']
+    return paths
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=DESCRIPTION, epilog=EPILOG, formatter_class=CustomFormatter)
+    parser.add_argument('commands', metavar='COMMAND', type=str, nargs='*', help='edit command')
+    parser.add_argument('-f', '--filepath', metavar='FILE', dest='paths', action='append', type=str,
+                        help='file to edit, `-` for stdin, may be repeated and may be a glob pattern')
+    parser.add_argument('--files-from', metavar='LIST', dest='files_from', action='store', type=str, default=None,
+                        help='read the files to edit from LIST (`-` for stdin), one per line or NUL separated')
+    parser.add_argument('-j', '--jobs', metavar='N', dest='jobs', action='store', type=non_negative, default=1,
+                        help='number of worker processes when editing several files or a large file with only '
+                             'line commands (not with -M), 0 for one per CPU')
+    parser.add_argument('-e', '--in-place', dest='inplace', action='store_true', default=False,
+                        help='edit in place, update source file while making backup')
+    parser.add_argument('--status', dest='status', action='store_true', default=False,
+                        help='with -e print `changed FILE` or `unchanged FILE` to stderr for each file, unchanged '
+                             'files are neither backed up nor rewritten')
+    parser.add_argument('-i', '--ignore-case', dest='insensitive', action='store_const', default=0,
+                        const=re.IGNORECASE, help='case insensitive matching')
+    parser.add_argument('-n', '--normalize', dest='normalize', action='store_true', default=False,
+                        help='normalize line endings, even when using multiline')
+    parser.add_argument('-F', '--fixed', dest='fixed', action='store_true', default=False,
+                        help='treat regular expression as a fixed string by quoting all meta char')
+    parser.add_argument('-m', '--multiline', dest='multiline', action='store_const', default=0,
+                        const=re.MULTILINE,
+                        help=r'`^` and `$` match beginning and end of lines, \A and \Z match beginning and end of file')
+    parser.add_argument('-d', '--dotall', dest='dotall', action='store_const', default=0,
+                        const=re.DOTALL, help='dot `.` will match any character including line endings')
+    parser.add_argument('-a', '--ascii', dest='ascii', action='store_const', default=0,
+                        const=re.ASCII,
+                        help=r'ascii mode where \w, \W, \b, \B, \d, \D, \s and \S only match ASCII characters')
+    parser.add_argument('-b', '--backup-path', metavar='DIR', dest='backup_dir', action='store', type=str, nargs=1,
+                        default='~/.ped-backups', help='backup directory')
+    parser.add_argument('--backup-compression', metavar='METHOD', dest='backup_compression', action='store',
+                        default='zlib', choices=list(BACKUP_SUFFIXES),
+                        help='compress backups with `zlib` (the default), `lzma` or `none`, identical content is only '
+                             'stored once whatever the method')
+    parser.add_argument('--backup-keep', metavar='N', dest='backup_keep', action='store', type=int, default=None,
+                        help='after editing in place keep only the newest N backups of each file')
+    parser.add_argument('--backup-max-age', metavar='DAYS', dest='backup_max_age', action='store', type=float,
+                        default=None, help='after editing in place drop backups older than DAYS days')
+    parser.add_argument('--backup-max-size', metavar='SIZE', dest='backup_max_size', action='store', type=byte_size,
+                        default=None, help='after editing in place drop the oldest backups until the backup store '
+                                           'takes at most SIZE bytes, K, M and G suffixes may be used')
+    parser.add_argument('--restore', metavar='FILE', dest='restore', action='store', default=None,
+                        help='write the latest backup of FILE back to FILE, or the latest made at or before '
+                             '--backup-time')
+    parser.add_argument('--backup-time', metavar='TIME', dest='backup_time', action='store', default=None,
+                        help='ISO date and time of the backup to --restore, e.g. 2024-05-01T13:30')
+    parser.add_argument('--list-backups', metavar='FILE', dest='list_backups', action='store', default=None,
+                        help='list the time, size and content hash of the backups of FILE')
+    parser.add_argument('-E', '--line-ending', metavar='CHAR', dest='ending', action='store',
+                        default=os.linesep, help='line ending to be used instead of platform default')
+    parser.add_argument('-Z', '--no-eof', dest='eof', action='store_false',
+                        default=True, help='suppress line ending on last line/end of file')
+    parser.add_argument('-M', '--max-substitutions', metavar='NUMBER', dest='maxsub', action='store', type=int,
+                        default=0, help='maximum total number of substitutions per command')
+    parser.add_argument('-L', '--line-max-substitutions', metavar='NUMBER', dest='maxlinesub', action='store', type=int,
+                        default=0, help='maximum total number of substitutions per line (for each command)')
+    parser.add_argument('-W', '--window', metavar='LINES', dest='window', action='store', type=window_size,
+                        default=0, help='apply cross-line substitutions (S, R, U, L, T, C) to a sliding window of '
+                                        'LINES lines at a time so huge input is edited in bounded memory, a match '
+                                        'longer than the window is an error')
+    parser.add_argument('--mmap', dest='mmap', action='store_true', default=False,
+                        help='run a leading S, R or O command as a bytes regular expression over a memory map of '
+                             'FILE, unless its pattern has non-ASCII characters, FILE has \\r line endings or, for a '
+                             'non-ASCII FILE, the pattern uses `.`, \\w, \\b, \\s, \\d, negations or -i')
+    parser.add_argument('--profile', metavar='FORMAT', dest='profile', action='store', default=None,
+                        choices=['table', 'json'],
+                        help='report the time, sizes, matches and list/string conversions of each command to stderr '
+                             'as a `table` (the default) or as `json` with --profile=json, files are edited one at '
+                             'a time while profiling')
+    parser.add_argument('--pattern-cache', metavar='SIZE', dest='pattern_cache', action='store', type=non_negative,
+                        default=None, help='number of compiled patterns and their analysis kept for reuse, by a '
+                                          '--serve server or when used as a library (default: 256)')
+    server = parser.add_mutually_exclusive_group()
+    server.add_argument('--serve', metavar='SOCKET', dest='serve', action='store', default=None,
+                        help='run as a server on the unix domain socket SOCKET, editing the command lines forwarded '
+                             'with --connect one at a time so startup and compiled patterns are shared by them')
+    server.add_argument('--connect', metavar='SOCKET', dest='connect', action='store', default=None,
+                        help='forward this command line with stdin and the working directory to a `ped --serve` '
+                             'server on SOCKET instead of running it')
+    parser.add_argument('--force-color', dest='color', default=None, action='store_false',
+                        help="force use of ANSI color adornment even if output stream does not appear to support it")
+    parser.add_argument('--no-color', dest='color', default=None, action='store_true',
+                        help="disable ANSI color adornment even if output stream appears to support it")
+    return parser
+
+
+def iter_glob(pattern):
+    import glob
+    return glob.iglob(pattern, recursive=True)
+
+
+def parse_args(argv):
+    return init_args(get_parser().parse_args(['--profile=table' if arg == '--profile' else arg for arg in argv]))
+
+
+def init_args(args):
+    # profiled files are edited one at a time
+    args.path = args.paths[0] if args.paths else '-'
+    if args.pattern_cache is not None:
+        PATTERNS.resize(args.pattern_cache)
+    args.profiler = Profile(args) if args.profile else None
+    if args.profiler is not None:
+        args.jobs = 1
+    return args
+
+
+def byte_size(value):
+    match = re.match(r'^(\d+)([kKmMgG]?)$', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f'invalid size: "{value}"')
+    return int(match[1]) << {'': 0, 'k': 10, 'm': 20, 'g': 30}[match[2].lower()]
+
+
+def window_size(value):
+    size = int(value)
+    if size < 2:
+        raise argparse.ArgumentTypeError(f'window must be at least 2 lines: "{value}"')
+    return size
+
+
+def non_negative(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'must not be negative: "{value}"')
+    return number
+
+
+def clamp_index(index, length):
+    # resolve a position the way a slice bound would be
+    return max(length + index, 0) if index < 0 else min(index, length)
+
+
+def join_lines(args: argparse.Namespace, lines):
+    return args.ending.join(lines) + (args.ending if len(lines) and args.eof else '')
+
+
+def get_lines(args: argparse.Namespace, data):
+    if isinstance(data, list):
+        return data
+    elif isinstance(data, Document):
+        return data.get_lines(args)
+    elif isinstance(data, TextChunks):
+        count_conversion(args)
+        return ''.join(data).splitlines()
+    elif isinstance(data, str):
+        count_conversion(args)
+        return data.splitlines()
+    return list(data)
+
+
+def get_string(args: argparse.Namespace, data):
+    if isinstance(data, TextChunks):
+        return ''.join(data)
+    elif isinstance(data, Document):
+        return data.get_string(args)
+    elif isinstance(data, str):
+        return data
+    lines = get_lines(args, data)
+    count_conversion(args)
+    return join_lines(args, lines)
+
+
+def count_conversion(args: argparse.Namespace):
+    profiler = getattr(args, 'profiler', None)
+    if profiler is not None:
+        profiler.conversions()
+
+
+class Document:
+    # the text in the form the last command returned, converted lazily when a command needs the other form
+    def __init__(self, data):
+        self.data = data
+        self.string = data if isinstance(data, str) else None
+        self.lines = data if isinstance(data, list) else None
+
+    def get_lines(self, args: argparse.Namespace):
+        if self.lines is None:
+            self.lines = get_lines(args, self.string if self.string is not None else self.data)
+        return self.lines
+
+    def get_string(self, args: argparse.Namespace):
+        if self.string is None:
+            self.string = get_string(args, self.data)
+        return self.string
+
+    def update(self, data):
+        # a command returning the string it was given didn't change the text, lists can be changed in place
+        if data is not self.string:
+            return Document(data)
+        self.data = data
+        return self
+
+
+def get_form(data):
+    return data.data if isinstance(data, Document) else data
+
+
+class TextChunks:
+    # text pieces that concatenate to the full text, as opposed to a stream of lines
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class Segments(TextChunks):
+    # strings or (buffer, start, end) ranges of a larger buffer, so edits and output don't copy the whole text
+    chunk_size = 1 << 20
+
+    def __init__(self, segments):
+        super().__init__([seg for seg in segments if (seg if isinstance(seg, str) else seg[1] < seg[2])])
+
+    def __iter__(self):
+        size = self.chunk_size
+        for seg in self.chunks:
+            if isinstance(seg, str):
+                yield seg
+            else:
+                buf, start, end = seg
+                for pos in range(start, end, size):
+                    yield buf[pos:min(pos + size, end)]
+
+    def __len__(self):
+        return sum(len(seg) if isinstance(seg, str) else seg[2] - seg[1] for seg in self.chunks)
+
+    def splice(self, start, end, text=''):
+        # start and end are resolved like slice bounds, no buffer is copied so this works as a piece table
+        before, after = [], []
+        pos = 0
+        for seg in self.chunks:
+            size = len(seg) if isinstance(seg, str) else seg[2] - seg[1]
+            before.append(slice_segment(seg, 0, start - pos))
+            after.append(slice_segment(seg, end - pos, size))
+            pos += size
+        return Segments(before + [text] + after)
+
+
+def slice_segment(seg, start, end):
+    if isinstance(seg, str):
+        return seg[max(start, 0):max(end, 0)]
+    buf, first, last = seg
+    return buf, min(first + max(start, 0), last), min(first + max(end, 0), last)
+
+
+def get_segments(args: argparse.Namespace, data):
+    if isinstance(get_form(data), Segments):
+        return get_form(data)
+    text = get_string(args, data)
+    return Segments([(text, 0, len(text))])
+
+
+class ByteChunks(TextChunks):
+    # UTF-8 encoded pieces of the full text
+    pass
+
+
+class LineIndex:
+    # line starts found lazily from whichever end of the text is closer
+    def __init__(self, text):
+        self.text = text
+        self.terminated = text.endswith('\n')
+        self.count = text.count('\n') + (1 if text and not self.terminated else 0)
+        self.head = array.array('q', [0])
+        self.tail = array.array('q', [len(text)])
+
+    def __len__(self):
+        return self.count
+
+    def start(self, line):
+        # the length of the text for the line after the last one
+        head, tail, text = self.head, self.tail, self.text
+        from_end = self.count - line
+        if line < len(head):
+            return head[line]
+        if from_end < len(tail):
+            return tail[from_end]
+        if line - len(head) <= from_end - len(tail):
+            pos = head[-1]
+            while len(head) <= line:
+                pos = text.index('\n', pos) + 1
+                head.append(pos)
+            return pos
+        pos = tail[-1]
+        while len(tail) <= from_end:
+            pos = text.rfind('\n', 0, pos - 1 if text[pos - 1] == '\n' else pos) + 1
+            tail.append(pos)
+        return pos
+
+
+class IndexedLines(Segments):
+    # each piece is either a range of line numbers of the indexed text or a list of new lines
+    def __init__(self, index, pieces):
+        self.index = index
+        self.pieces = [piece for piece in pieces if len(piece)]
+        super().__init__(self.iter_segments())
+
+    def iter_segments(self):
+        index = self.index
+        for piece in self.pieces:
+            if isinstance(piece, range):
+                yield index.text, index.start(piece.start), index.start(piece.stop)
+                if piece.stop == len(index) and not index.terminated:
+                    yield '\n'
+            else:
+                yield ''.join([line + '\n' for line in piece])
+
+    def line_count(self):
+        return sum(len(piece) for piece in self.pieces)
+
+    def splice_lines(self, start, end, lines):
+        # lines[:start] + lines + lines[end:] for non-negative start and end
+        before, after = [], []
+        pos = 0
+        for piece in self.pieces:
+            before.append(piece[:max(start - pos, 0)])
+            after.append(piece[max(end - pos, 0):])
+            pos += len(piece)
+        return IndexedLines(self.index, before + [lines] + after)
+
+
+def can_index_lines(args: argparse.Namespace, data, cmd):
+    # the text must already have the line endings and end of file the output would be normalized to
+    if args.ending != '\n' or not args.eof or has_other_separators(cmd.text):
+        return False
+    if isinstance(get_form(data), IndexedLines):
+        return True
+    return isinstance(get_form(data), (str, Segments)) and not has_other_separators(get_string(args, data))
+
+
+def has_other_separators(text):
+    # a substring search per separator is much faster than searching for a character class
+    return any(sep in text for sep in OTHER_SEPARATORS)
+
+
+def get_indexed_lines(args: argparse.Namespace, data):
+    if isinstance(get_form(data), IndexedLines):
+        return get_form(data)
+    index = LineIndex(get_string(args, data))
+    return IndexedLines(index, [range(len(index))])
+
+
+def as_line_stream(_args: argparse.Namespace, data):
+    if isinstance(data, str):
+        return data.splitlines()
+    return iter_text_lines(data) if isinstance(data, TextChunks) else data
+
+
+def as_text_stream(args: argparse.Namespace, data):
+    if isinstance(data, str):
+        return [data]
+    return data if isinstance(data, TextChunks) else iter_output(args, data)
+
+
+def iter_text_lines(chunks):
+    # the same lines splitlines() would produce for the joined text
+    partial = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        pieces = (partial + chunk).splitlines(keepends=True)
+        last = pieces[-1]
+        partial = last if last[-1] == '\r' or last.splitlines()[0] == last else ''
+        if partial:
+            pieces.pop()
+        yield from ''.join(pieces).splitlines()
+    yield from partial.splitlines()
+
+
+def get_normalized_lines(args: argparse.Namespace, data):
+    return get_lines(args, get_string(args, data))
+
+
+def split_text(text):
+    # a trailing line ending adds an empty line
+    return (text + '\n').splitlines() if '\n' in text else [text]
+
+
+def iter_split_end(stage, split=False):
+    # with -Z lines are split again by joining them without the last line ending, losing a trailing empty line,
+    # a stage returns whether it split a line
+    last = None
+    while True:
+        try:
+            line = next(stage)
+        except StopIteration as stop:
+            split = split or stop.value
+            break
+        if last is not None:
+            yield last
+        last = line
+    if last is not None and (last or not split):
+        yield last
+
+
+def read_input(args: argparse.Namespace):
+    return sys.stdin.read() if args.path == '-' else get_file_contents(args.path)
+
+
+def iter_input(args: argparse.Namespace):
+    if args.path == '-':
+        yield from sys.stdin
+    else:
+        with open(args.path, encoding='utf-8') as f:
+            yield from f
+
+
+def iter_input_lines(args: argparse.Namespace):
+    for raw in iter_input(args):
+        yield from raw.splitlines()
+
+
+def get_input_stream(args: argparse.Namespace, cmd):
+    normalized = args.normalize and not args.eof
+    if is_block_stage(args, cmd) and not normalized:
+        return TextChunks(iter_input_blocks(args))
+    if cmd.op in LINE_STAGES and normalized:
+        # the normalized text is split into lines again
+        return iter_split_end(iter_input_lines(args), True)
+    if cmd.op in LINE_STAGES or args.normalize:
+        return iter_input_lines(args)
+    return TextChunks(iter_input(args))
+
+
+def iter_input_blocks(args: argparse.Namespace):
+    f = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+    try:
+        while lines := f.readlines(BLOCK_SIZE):
+            yield ''.join(lines)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def iter_output(args: argparse.Namespace, lines):
+    ending = args.ending
+    if args.eof:
+        for line in lines:
+            yield line + ending
+        return
+    last = None
+    for line in lines:
+        if last is not None:
+            yield last + ending
+        last = line
+    if last is not None:
+        yield last
+
+
+def write_output(args: argparse.Namespace, data, stream):
+    if isinstance(data, str):
+        stream.write(data)
+    elif isinstance(data, ByteChunks) and hasattr(stream, 'buffer'):
+        stream.flush()
+        stream.buffer.writelines(data)
+    elif isinstance(data, ByteChunks):
+        stream.writelines(iter_decoded(data))
+    elif isinstance(data, TextChunks):
+        stream.writelines(data)
+    else:
+        stream.writelines(iter_output(args, data))
+
+
+def is_streamable(args: argparse.Namespace, cmd):
+    # negative line numbers need the whole input, cross-line substitutions can stream through --window
+    if cmd.op in [LINE_INSERT, LINE_REPLACE, LINE_DELETE]:
+        return cmd.num1 >= 0 and cmd.num2 >= 0
+    return cmd.op in LINE_STAGES or (args.window > 0 and cmd.op in WINDOW_STAGES)
+
+
+def plan(args: argparse.Namespace, commands):
+    # (streamed, commands) tuples of consecutive streamable and buffered commands
+    segments = []
+    for cmd in commands:
+        streamed = is_streamable(args, cmd)
+        if segments and segments[-1][0] == streamed:
+            segments[-1][1].append(cmd)
+        else:
+            segments.append((streamed, [cmd]))
+    return segments
+
+
+def run_segments(args: argparse.Namespace, segments, data):
+    # streamed segments return a lazy iterator of lines, buffered segments a str or list
+    profiler = args.profiler
+    for streamed, commands in segments:
+        if streamed:
+            for by_line, group in itertools.groupby(commands, lambda cmd: cmd.op in LINE_STAGES):
+                if by_line:
+                    data = chain_line_stages(args, data, list(group))
+                else:
+                    for cmd in group:
+                        lines = iter_window_lines(as_text_stream(args, data))
+                        data = TextChunks(WINDOW_STAGES[cmd.op](args, lines, cmd))
+                        if profiler is not None:
+                            data = TextChunks(profiler.stream(profiler.command_stage(cmd), data, text=True))
+        else:
+            if profiler is not None:
+                data = profiler.materialize(data)
+            data = execute(args, commands, data)
+    return data
+
+
+def param_str(cmd, sep='/'):
+    str1, *_ = f'{cmd[2:]}{sep}'.split(sep, 2)
+    return str1
+
+
+def param_str_str(cmd, sep='/'):
+    (str1, str2, *_) = f'{cmd[2:]}{sep}'.split(sep, 2)
+    return str1, str2
+
+
+def param_num_str(cmd, sep='/'):
+    (num, s, *_) = f'{cmd[2:]}{sep}'.split(sep, 2)
+    num = num.strip()
+    if not re.match(r'^-?\d+$', num):
+        raise ValueError(f'Expected a numeric parameter: "{num}"')
+    return int(num), s
+
+
+def param_num_num_str(cmd, sep='/'):
+    (num1, num2, str1, *_) = f'{cmd[2:]}{sep}'.split(sep, 3)
+    num1 = num1.strip()
+    if not re.match(r'^-?\d+$', num1):
+        raise ValueError(f'Expected a numeric parameter: "{num1}"')
+    num2 = num2.strip()
+    if not re.match(r'^-?\d+$', num2):
+        raise ValueError(f'Expected a numeric parameter: "{num2}"')
+    return int(num1), int(num2), str1
+
+
+def param_num_num(cmd, sep='/'):
+    (num1, num2, *_) = f'{cmd[2:]}{sep}'.split(sep, 2)
+    num1 = num1.strip()
+    if not re.match(r'^-?\d+$', num1):
+        raise ValueError(f'Expected a numeric parameter: "{num1}"')
+    num2 = num2.strip()
+    if not re.match(r'^-?\d+$', num2):
+        raise ValueError(f'Expected a numeric parameter: "{num2}"')
+    return int(num1), int(num2)
+
+
+class Command(collections.namedtuple('Command', ['op', 'item', 'sep', 'pattern', 'replacement', 'text', 'num1',
+                                                  'num2', 'literal', 'literal_replacement', 'guard'],
+                                      defaults=['/', None, None, '', 0, 0, None, None, ''])):
+    # the guard is text every match contains, a named tuple since dataclasses is slow to import
+    __slots__ = ()
+
+
+def get_flags(args: argparse.Namespace):
+    return args.insensitive | args.multiline | args.ascii | args.dotall
+
+
+def compile_pattern(args, e, fixed=False):
+    return PATTERNS.get(e, get_flags(args), fixed).pattern
+
+
+class CachedPattern:
+    # each part of the analysis is worked out when first needed
+
+    def __init__(self, key, pattern):
+        self.key = key
+        self.pattern = pattern
+
+    @functools.cached_property
+    def parsed(self):
+        try:
+            return sre_parse.parse(self.pattern.pattern, self.pattern.flags)
+        except (re.error, RecursionError, TypeError):
+            return None
+
+    @functools.cached_property
+    def literal(self):
+        text, _, fixed = self.key
+        return get_literal(text, fixed) if isinstance(text, str) else None
+
+    @functools.cached_property
+    def prefix(self):
+        if self.literal is not None and not self.pattern.flags & re.IGNORECASE:
+            return self.literal
+        return '' if self.parsed is None else items_literal_prefix(self.parsed, self.pattern.flags)
+
+    @functools.cached_property
+    def required(self):
+        if self.literal is not None and not self.pattern.flags & re.IGNORECASE:
+            return self.literal
+        try:
+            return '' if self.parsed is None else items_required_literal(self.parsed, self.pattern.flags)
+        except RecursionError:
+            return ''
+
+    @functools.cached_property
+    def partial(self):
+        # matches where a match attempt could still be running at the end of the text, for --window
+        if self.parsed is None:
+            return re.compile(r'(?s).*\Z')
+        try:
+            return compile_partial(self.parsed)
+        except (RecursionError, re.error, TypeError):
+            return re.compile(r'(?s).*\Z')
+
+    @functools.cached_property
+    def uses_unicode(self):
+        # matches differently on the UTF-8 bytes of the text
+        try:
+            return (self.parsed is None or self.parsed.getwidth()[0] == 0
+                    or items_use_unicode(self.parsed, self.pattern.flags))
+        except RecursionError:
+            return True
+
+    @functools.cached_property
+    def spans_lines(self):
+        try:
+            return self.parsed is None or items_span_lines(self.parsed, self.pattern.flags)
+        except RecursionError:
+            return True
+
+
+class PatternCache:
+    # least recently used is evicted, patterns that did not come from the cache are looked up by the pattern
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.by_pattern = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, flags, fixed=False, count=True):
+        # patterns ped derives from a command's pattern are looked up without counting
+        key = (text, flags, fixed)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += count
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += count
+        return self.add(CachedPattern(key, re.compile(re.escape(text) if fixed else text, flags)))
+
+    def analyze(self, pattern):
+        # ped's own lookups are not counted as hits or misses
+        entry = self.by_pattern.get(pattern)
+        if entry is not None:
+            self.entries.move_to_end(entry.key)
+            return entry
+        return self.add(CachedPattern((pattern.pattern, pattern.flags, False), pattern))
+
+    def add(self, entry):
+        self.entries[entry.key] = entry
+        self.by_pattern[entry.pattern] = entry
+        self.resize(self.size)
+        return entry
+
+    def resize(self, size):
+        self.size = size
+        while len(self.entries) > size:
+            _, entry = self.entries.popitem(last=False)
+            if self.by_pattern.get(entry.pattern) is entry:
+                del self.by_pattern[entry.pattern]
+
+
+PATTERNS = PatternCache()
+
+
+def get_literal(e, fixed=False):
+    # the text a pattern matches when it has no regular expression meta characters
+    return e if e and (fixed or not META_CHARS.search(e)) else None
+
+
+def get_literal_replacement(r):
+    # None if the replacement refers to a group
+    if '\\' not in r:
+        return r
+    if '\\g' in r:
+        return None
+    try:
+        return re.match('', '').expand(r)
+    except re.error:
+        return None
+
+
+def compile_command(args, item):
+    op = item[0]
+    sep = item[1]
+    if op in [FILE_SUB, LINE_SUB, LINE_FIXED_SUB]:
+        e, r = param_str_str(item, sep)
+        fixed = args.fixed or op == LINE_FIXED_SUB
+        entry = PATTERNS.get(e, get_flags(args), fixed)
+        entry.pattern.sub(r, '')  # reports an invalid template even when the pattern never matches
+        return Command(op, item, sep, pattern=entry.pattern, replacement=r, literal=get_literal(e, fixed),
+                       literal_replacement=get_literal_replacement(r), guard=entry.required)
+    elif op in [FILE_REMOVE, LINE_REMOVE]:
+        e = param_str(item, sep)
+        entry = PATTERNS.get(e, get_flags(args), args.fixed)
+        return Command(op, item, sep, pattern=entry.pattern, replacement='', literal=get_literal(e, args.fixed),
+                       literal_replacement='', guard=entry.required)
+    elif op in ALL_FILTERS or op == FILE_ONLY:
+        e = param_str(item, sep)
+        entry = PATTERNS.get(e, get_flags(args), args.fixed)
+        return Command(op, item, sep, pattern=entry.pattern, literal=get_literal(e, args.fixed),
+                       guard=entry.required)
+    elif op in XFORMS:
+        e = param_str(item, sep)
+        entry = PATTERNS.get(e, get_flags(args), args.fixed)
+        literal = get_literal(e, args.fixed)
+        return Command(op, item, sep, pattern=entry.pattern, replacement=get_xform(op), literal=literal,
+                       literal_replacement=XFORMS[op](literal) if literal else None,
+                       guard=entry.required)
+    elif op in [LINE_APPEND, LINE_PREPEND, FILE_APPEND, FILE_PREPEND]:
+        return Command(op, item, sep, text=param_str(item, sep))
+    elif op in [LINE_INSERT, FILE_INSERT]:
+        index, text = param_num_str(item, sep)
+        return Command(op, item, sep, text=text, num1=index)
+    elif op in [LINE_REPLACE, FILE_REPLACE]:
+        start, count, text = param_num_num_str(item, sep)
+        return Command(op, item, sep, text=text, num1=start, num2=count)
+    elif op in [LINE_DELETE, FILE_DELETE]:
+        start, count = param_num_num(item, sep)
+        return Command(op, item, sep, num1=start, num2=count)
+    raise PedError(f'Unknown command: "{op}" from the "{item}" command', PedErrorTypes.PED_UNKNOWN_COMMAND_ERROR)
+
+
+def compile_commands(args):
+    return [compile_command(args, item) for item in args.commands]
+
+
+def execute(args, commands, data):
+    document = data if isinstance(data, Document) else Document(data)
+    for cmd in commands:
+        document = document.update(run_handler(args, document, cmd))
+    return document.data
+
+
+def run_handler(args, data, cmd):
+    if args.profiler is not None:
+        return args.profiler.call(args.profiler.command_stage(cmd), HANDLERS[cmd.op], args, data, cmd)
+    return HANDLERS[cmd.op](args, data, cmd)
+
+
+def insert_line(args, data, cmd):
+    if can_index_lines(args, data, cmd):
+        indexed = get_indexed_lines(args, data)
+        index = clamp_index(cmd.num1, indexed.line_count())
+        return indexed.splice_lines(index, index, split_text(cmd.text))
+    lines = get_lines(args, data)
+    index = cmd.num1
+    if index < 0:
+        count = len(lines)
+        index = max(count + index, 0)
+    lines.insert(index, cmd.text)
+    return get_normalized_lines(args, lines) if '\n' in cmd.text else lines
+
+
+def insert_chars(args, data, cmd):
+    segments = get_segments(args, data)
+    index = clamp_index(cmd.num1, len(segments))
+    return segments.splice(index, index, cmd.text)
+
+
+def iter_insert_line(_args, lines, cmd):
+    index = 0
+    for line in lines:
+        if index == cmd.num1:
+            yield from split_text(cmd.text)
+        yield line
+        index += 1
+    if index <= cmd.num1:
+        yield from split_text(cmd.text)
+    return '\n' in cmd.text
+
+
+def replace_lines(args, data, cmd):
+    start, count = cmd.num1, cmd.num2
+    if can_index_lines(args, data, cmd):
+        indexed = get_indexed_lines(args, data)
+        total = indexed.line_count()
+        return indexed.splice_lines(clamp_index(start, total), clamp_index(start + count, total), cmd.text.splitlines())
+    lines = get_lines(args, data)
+    return lines[:start] + cmd.text.splitlines() + lines[start + count:]
+
+
+def iter_replace_lines(_args, lines, cmd):
+    start, end = cmd.num1, cmd.num1 + cmd.num2
+    index = 0
+    for line in lines:
+        if index == start:
+            yield from cmd.text.splitlines()
+        if not start <= index < end:
+            yield line
+        index += 1
+    if index <= start:
+        yield from cmd.text.splitlines()
+
+
+def replace_chars(args, data, cmd):
+    segments = get_segments(args, data)
+    size = len(segments)
+    return segments.splice(clamp_index(cmd.num1, size), clamp_index(cmd.num1 + cmd.num2, size), cmd.text)
+
+
+def delete_lines(args, data, cmd):
+    start, count = cmd.num1, cmd.num2
+    if can_index_lines(args, data, cmd):
+        indexed = get_indexed_lines(args, data)
+        total = indexed.line_count()
+        return indexed.splice_lines(clamp_index(start, total), clamp_index(start + count, total), [])
+    lines = get_lines(args, data)
+    return lines[:start] + lines[start + count:]
+
+
+def iter_delete_lines(_args, lines, cmd):
+    start, end = cmd.num1, cmd.num1 + cmd.num2
+    return (line for index, line in enumerate(lines) if not start <= index < end)
+
+
+def delete_chars(args, data, cmd):
+    segments = get_segments(args, data)
+    size = len(segments)
+    return segments.splice(clamp_index(cmd.num1, size), clamp_index(cmd.num1 + cmd.num2, size))
+
+
+def append_prepend_line(args, data, cmd):
+    lines = iter_append_prepend_line(args, get_lines(args, data), cmd)
+    return list(lines if args.eof else iter_split_end(lines))
+
+
+def iter_append_prepend_line(_args, lines, cmd):
+    if cmd.op == LINE_PREPEND:
+        yield from split_text(cmd.text)
+    yield from lines
+    if cmd.op == LINE_APPEND:
+        yield from split_text(cmd.text)
+    return '\n' in cmd.text
+
+
+def append_prepend_characters(args, data, cmd):
+    segments = get_segments(args, data).chunks
+    if cmd.op == FILE_APPEND:
+        return Segments(segments + [cmd.text])
+    return Segments([cmd.text] + segments)
+
+
+def xform_file(args, data, cmd):
+    return file_sub(args, data, cmd)
+
+
+def xform_lines(args, data, cmd):
+    return list(iter_xform_lines(args, get_lines(args, data), cmd))
+
+
+def iter_xform_lines(args, lines, cmd):
+    subn = get_line_subn(args, cmd)
+    if args.maxsub > 0:
+        maxsub = args.maxsub
+        subs = maxsub if args.maxlinesub == 0 else min(maxsub, args.maxlinesub)
+        for line in lines:
+            if maxsub > 0:
+                line, count = subn(line, count=min(subs, maxsub))
+                maxsub -= count
+            yield line
+        if args.profiler is not None:
+            args.profiler.count(cmd, args.maxsub - maxsub)
+    else:
+        profiler = args.profiler
+        for line in lines:
+            line, count = subn(line)
+            if count and profiler is not None:
+                profiler.count(cmd, count)
+            yield line
+
+
+XFORMS = {
+    LINE_UPPER: str.upper, FILE_UPPER: str.upper,
+    LINE_LOWER: str.lower, FILE_LOWER: str.lower,
+    LINE_TITLE: str.title, FILE_TITLE: str.title,
+    LINE_CAPITALIZE: str.capitalize, FILE_CAPITALIZE: str.capitalize,
+}
+
+
+def xform(match, op):
+    if op not in XFORMS:
+        raise ValueError(f'Unknown command: "{op}"')
+    return XFORMS[op](match[0])
+
+
+def get_xform(op):
+    return functools.partial(xform, op=op)
+
+
+def filter_lines(args, data, cmd):
+    return list(iter_filter_lines(args, get_lines(args, data), cmd))
+
+
+def iter_filter_lines(args, lines, cmd):
+    op = cmd.op
+    finditer = cmd.pattern.finditer
+    if op in [FILTER, LINE_FILTER]:
+        check = get_check(args, cmd)
+        return (line for line in lines if check(line))
+    elif op in [EXCLUDE, LINE_EXCLUDE]:
+        check = get_check(args, cmd)
+        return (line for line in lines if not check(line))
+    elif op == LINE_ONLY and literal_mode(args, cmd) == LITERAL_EXACT:
+        literal = cmd.literal
+        counts = (line.count(literal) for line in lines)
+        return (literal * count for count in counts if count)
+    elif op == LINE_ONLY and cmd.guard:
+        guard = cmd.guard
+        only = ([match[0] for match in finditer(line)] for line in lines if guard in line)
+        return (''.join(matches) for matches in only if len(matches))
+    elif op == LINE_ONLY:
+        only = ([match[0] for match in finditer(line)] for line in lines)
+        return (''.join(matches) for matches in only if len(matches))
+    elif op == LINE_REMOVE:
+        subn = get_line_subn(args, cmd)
+        if args.profiler is not None:
+            return iter_counted_subn(args.profiler, cmd, subn, lines)
+        return (subn(line)[0] for line in lines)
+    raise ValueError(f'Unknown command: "{op}" from the "{cmd.item}" command')
+
+
+def iter_counted_subn(profiler, cmd, subn, lines):
+    for line in lines:
+        line, count = subn(line)
+        if count:
+            profiler.count(cmd, count)
+        yield line
+
+
+def literal_mode(args, cmd):
+    # LITERAL_EXACT with str methods, LITERAL_FOLDED by lowercasing ASCII text, or None
+    if cmd.literal is None:
+        return None
+    if not args.insensitive or cmd.literal.lower() == cmd.literal.upper():
+        return LITERAL_EXACT
+    return LITERAL_FOLDED if cmd.literal.isascii() else None
+
+
+def get_line_subn(args, cmd):
+    regex_subn = functools.partial(cmd.pattern.subn, cmd.replacement)
+    mode = literal_mode(args, cmd)
+    if mode == LITERAL_EXACT and cmd.literal_replacement is not None:
+        return literal_subn(cmd.literal, cmd.literal_replacement)
+    elif mode == LITERAL_FOLDED and cmd.literal_replacement is not None and cmd.op not in XFORMS:
+        return folded_subn(cmd.literal, cmd.literal_replacement, regex_subn)
+    return guarded_subn(cmd.guard, regex_subn) if cmd.guard else regex_subn
+
+
+def guarded_subn(guard, regex_subn):
+    # a substring search is much faster than starting the regular expression engine on a line
+    def subn(line, count=0):
+        if guard not in line:
+            return line, 0
+        return regex_subn(line, count=count)
+    return subn
+
+
+def literal_subn(literal, replacement):
+    def subn(line, count=0):
+        n = line.count(literal)
+        if not n:
+            return line, 0
+        if 0 < count < n:
+            n = count
+        return line.replace(literal, replacement, n), n
+    return subn
+
+
+def folded_subn(literal, replacement, regex_subn):
+    # lowercasing only changes ASCII letters in an ASCII line, other lines fall back to the regular expression
+    folded = literal.lower()
+    size = len(literal)
+
+    def subn(line, count=0):
+        if not line.isascii():
+            return regex_subn(line, count=count)
+        lower = line.lower()
+        pos = lower.find(folded)
+        if pos < 0:
+            return line, 0
+        out = []
+        start = n = 0
+        while pos >= 0 and (not count or n < count):
+            out.append(line[start:pos])
+            out.append(replacement)
+            start = pos + size
+            n += 1
+            pos = lower.find(folded, start)
+        out.append(line[start:])
+        return ''.join(out), n
+    return subn
+
+
+def get_check(args, cmd):
+    if literal_mode(args, cmd) != LITERAL_EXACT:
+        check = FUSED_FILTERS[cmd.op](cmd.pattern)
+        guard = cmd.guard
+        return (lambda line: guard in line and check(line)) if guard else check
+    literal = cmd.literal
+    if cmd.op in [LINE_FILTER, LINE_EXCLUDE]:
+        return literal.__eq__
+    return lambda line: literal in line
+
+
+def is_block_stage(args, cmd):
+    return get_block_stage(args, cmd) is not None
+
+
+def get_block_stage(args, cmd):
+    # substitutions that can neither match nor create a line separator other than \n can run on blocks of lines
+    if cmd.op not in BLOCK_COMMANDS or args.maxsub > 0 or args.maxlinesub > 0:
+        return None
+    # with -Z a line ending added to a line has the lines split again per command, see iter_split_end
+    if literal_mode(args, cmd) == LITERAL_EXACT and cmd.literal_replacement is not None:
+        text = cmd.literal_replacement
+        if [cmd.literal] == cmd.literal.splitlines() and is_line_replacement(text) and (args.eof or '\n' not in text):
+            return iter_literal_blocks
+        return None
+    text = '' if callable(cmd.replacement) else get_template_text(cmd.pattern, cmd.replacement)
+    if is_line_replacement(text) and (args.eof or '\n' not in text):
+        return None if can_span_lines(cmd.pattern) else iter_regex_blocks
+    return None
+
+
+def is_line_replacement(text):
+    # replacement text splits into the same lines in a block as after a per line substitution
+    return text is not None and ('\n' in text or [text] == text.splitlines() or not text)
+
+
+def get_template_text(pattern, template):
+    # None for an invalid template
+    names = {index: name for name, index in pattern.groupindex.items()}
+    groups = ''.join(f'(?P<{names[i]}>)' if i in names else '()' for i in range(1, pattern.groups + 1))
+    try:
+        return re.match(groups, '').expand(template)
+    except (re.error, IndexError):
+        return None
+
+
+def can_span_lines(pattern):
+    # anything the analysis does not recognize is assumed to span lines
+    return PATTERNS.analyze(pattern).spans_lines
+
+
+def get_literal_prefix(pattern):
+    # empty if there is none or it is matched ignoring case
+    return PATTERNS.analyze(pattern).prefix
+
+
+def get_required_literal(pattern):
+    # the longest text every match contains, empty if there is none or it is matched ignoring case
+    return PATTERNS.analyze(pattern).required
+
+
+def items_literal_prefix(items, flags):
+    prefix = []
+    for op, av in items:
+        if op == sre_parse.LITERAL and not flags & re.IGNORECASE:
+            prefix.append(chr(av))
+        elif op == sre_parse.SUBPATTERN and not (av[1] | flags) & re.IGNORECASE:
+            inner = items_literal_prefix(av[3], flags)
+            prefix.append(inner)
+            if not is_literal_items(av[3]):
+                break
+        else:
+            break
+    return ''.join(prefix)
+
+
+def is_literal_items(items):
+    return all(op == sre_parse.LITERAL for op, _ in items)
+
+
+REPEATS = [sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)]
+
+
+def items_required_literal(items, flags):
+    # literals inside alternatives and optional parts are not in every match
+    found = ''
+    run = []
+    for op, av in items:
+        required = ''
+        if op == sre_parse.LITERAL and not flags & re.IGNORECASE:
+            run.append(chr(av))
+            continue
+        elif op == sre_parse.SUBPATTERN:
+            inner_flags = (flags | av[1]) & ~av[2]
+            required = items_required_literal(av[3], inner_flags)
+            if is_literal_items(av[3]) and not inner_flags & re.IGNORECASE:
+                run.append(required)
+                continue
+        elif op in REPEATS and av[0] > 0:
+            required = items_required_literal(av[2], flags)
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            required = items_required_literal(av, flags)
+        found = max(found, ''.join(run), required, key=len)
+        run = []
+    return max(found, ''.join(run), key=len)
+
+
+SINGLE_LINE_CATEGORIES = {sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_SPACE, sre_parse.CATEGORY_WORD,
+                          sre_parse.CATEGORY_NOT_LINEBREAK}
+SINGLE_LINE_ANCHORS = {sre_parse.AT_BEGINNING, sre_parse.AT_END, sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY}
+
+
+def items_span_lines(items, flags):
+    newline = ord('\n')
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            spans = av == newline
+        elif op == sre_parse.NOT_LITERAL:
+            spans = av != newline
+        elif op == sre_parse.ANY:
+            spans = bool(flags & re.DOTALL)
+        elif op == sre_parse.IN:
+            spans = set_has_newline(av)
+        elif op == sre_parse.AT:
+            spans = av not in SINGLE_LINE_ANCHORS
+        elif op in REPEATS:
+            spans = items_span_lines(av[2], flags)
+        elif op == sre_parse.SUBPATTERN:
+            spans = items_span_lines(av[3], (flags | av[1]) & ~av[2])
+        elif op in [sre_parse.ASSERT, sre_parse.ASSERT_NOT]:
+            spans = items_span_lines(av[1], flags)
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            spans = items_span_lines(av, flags)
+        elif op == sre_parse.BRANCH:
+            spans = any(items_span_lines(branch, flags) for branch in av[1])
+        elif op == sre_parse.GROUPREF_EXISTS:
+            spans = any(items_span_lines(branch, flags) for branch in av[1:] if branch is not None)
+        else:
+            spans = op != sre_parse.GROUPREF
+        if spans:
+            return True
+    return False
+
+
+NEGATED_CATEGORIES = {sre_parse.CATEGORY_NOT_DIGIT, sre_parse.CATEGORY_NOT_SPACE, sre_parse.CATEGORY_NOT_WORD}
+
+
+def items_use_unicode(items, flags):
+    # `.`, negations and \B match inside a multibyte character whatever the flags
+    ascii = flags & re.ASCII
+    if flags & re.IGNORECASE and not ascii:
+        return True
+    for op, av in items:
+        if op in [sre_parse.ANY, sre_parse.NOT_LITERAL]:
+            found = True
+        elif op == sre_parse.IN:
+            found = any(item_op == sre_parse.NEGATE or item_op == sre_parse.CATEGORY
+                        and (not ascii or item_av in NEGATED_CATEGORIES) for item_op, item_av in av)
+        elif op == sre_parse.AT:
+            found = av == sre_parse.AT_NON_BOUNDARY or av == sre_parse.AT_BOUNDARY and not ascii
+        elif op in REPEATS:
+            found = items_use_unicode(av[2], flags)
+        elif op == sre_parse.SUBPATTERN:
+            found = items_use_unicode(av[3], (flags | av[1]) & ~av[2])
+        elif op in [sre_parse.ASSERT, sre_parse.ASSERT_NOT]:
+            found = items_use_unicode(av[1], flags)
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            found = items_use_unicode(av, flags)
+        elif op == sre_parse.BRANCH:
+            found = any(items_use_unicode(branch, flags) for branch in av[1])
+        elif op == sre_parse.GROUPREF_EXISTS:
+            found = any(items_use_unicode(branch, flags) for branch in av[1:] if branch is not None)
+        else:
+            found = False
+        if found:
+            return True
+    return False
+
+
+def compile_partial(parsed):
+    try:
+        import re._compiler as sre_compile
+    except ImportError:  # Python < 3.11
+        import sre_compile
+    state = sre_parse.State()
+    state.flags = parsed.state.flags
+    items = [(sre_parse.SUBPATTERN, (None, 0, 0, sre_parse.SubPattern(state, partial_items(state, parsed.data,
+                                                                                       True)))),
+             (sre_parse.AT, sre_parse.AT_END_STRING)]
+    return sre_compile.compile(sre_parse.SubPattern(state, items), parsed.state.flags)
+
+
+# the text of a partial match is a run of complete items followed by a prefix of the next item, assertions and
+# anchors are taken to hold and group references to match anything, so a match attempt is never missed, a lazy
+# repeat of the whole pattern stops where the rest of the pattern matches as the regular expression engine does
+def partial_items(state, items, top=False):
+    tail = []
+    for index in reversed(range(len(items))):
+        rest = exact_items(state, items[index + 1:]) if top and items[index][0] == sre_parse.MIN_REPEAT else None
+        if rest is None:
+            paths = [complete_items(state, [items[index]]) + tail, partial_item(state, items[index])]
+        else:
+            paths = [lazy_items(state, items[index], rest, False) + tail, lazy_items(state, items[index], rest, True)]
+        tail = [(sre_parse.BRANCH, (None, [sre_parse.SubPattern(state, path) for path in paths]))]
+    return tail
+
+
+def lazy_items(state, item, rest, partial):
+    lo, hi, body = item[1]
+    sub = functools.partial(sre_parse.SubPattern, state)
+    unless_rest = (sre_parse.ASSERT_NOT, (1, sub(rest)))
+    more = hi - lo if hi != sre_parse.MAXREPEAT else hi
+    if not partial:
+        return [(sre_parse.MAX_REPEAT, (lo, lo, sub(complete_items(state, body)))),
+                (sre_parse.MAX_REPEAT, (0, more, sub([unless_rest] + complete_items(state, body))))]
+    paths = []
+    if lo > 0:
+        paths.append([(sre_parse.MAX_REPEAT, (0, lo - 1, sub(complete_items(state, body))))]
+                     + partial_items(state, body))
+    if more > 0:
+        paths.append([(sre_parse.MAX_REPEAT, (lo, lo, sub(complete_items(state, body)))),
+                      (sre_parse.MAX_REPEAT, (0, more - 1 if more != sre_parse.MAXREPEAT else more,
+                                              sub([unless_rest] + complete_items(state, body)))),
+                      unless_rest] + partial_items(state, body))
+    return [(sre_parse.BRANCH, (None, [sub(path) for path in paths]))] if paths else []
+
+
+def exact_items(state, items):
+    # the items without their groups, None if they refer to a group
+    sub = functools.partial(sre_parse.SubPattern, state)
+    exact = []
+    for op, av in items:
+        if op in [sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS]:
+            return None
+        elif op == sre_parse.BRANCH:
+            branches = [exact_items(state, branch) for branch in av[1]]
+            if None in branches:
+                return None
+            exact.append((op, (None, [sub(branch) for branch in branches])))
+        elif op == sre_parse.SUBPATTERN or op in REPEATS or op in [sre_parse.ASSERT, sre_parse.ASSERT_NOT]:
+            inner = exact_items(state, av[-1])
+            if inner is None:
+                return None
+            exact.append((op, (None, *av[1:-1], sub(inner)) if op == sre_parse.SUBPATTERN else (*av[:-1], sub(inner))))
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            inner = exact_items(state, av)
+            if inner is None:
+                return None
+            exact.append((op, sub(inner)))
+        else:
+            exact.append((op, av))
+    return exact
+
+
+def partial_item(state, item):
+    op, av = item
+    sub = functools.partial(sre_parse.SubPattern, state)
+    if op in [sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN]:
+        return [(sre_parse.MAX_REPEAT, (0, 1, sub([item])))]
+    elif op in [sre_parse.ASSERT, sre_parse.ASSERT_NOT]:
+        return partial_items(state, av[1]) if av[0] > 0 else []
+    elif op == sre_parse.SUBPATTERN:
+        return [(op, (None, av[1], av[2], sub(partial_items(state, av[3]))))]
+    elif op in REPEATS:
+        if av[1] == 0:
+            return []
+        more = av[1] - 1 if av[1] != sre_parse.MAXREPEAT else av[1]
+        return [(sre_parse.MAX_REPEAT, (0, more, sub(complete_items(state, av[2])))),
+                (sre_parse.SUBPATTERN, (None, 0, 0, sub(partial_items(state, av[2]))))]
+    elif op == sre_parse.BRANCH:
+        return [(op, (None, [sub(partial_items(state, branch)) for branch in av[1]]))]
+    elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return partial_items(state, av)
+    elif op == sre_parse.GROUPREF_EXISTS:
+        branches = [branch or [] for branch in av[1:]]
+        return [(sre_parse.BRANCH, (None, [sub(partial_items(state, branch)) for branch in branches]))]
+    elif op == sre_parse.GROUPREF:
+        return anything(state)
+    return []
+
+
+def complete_items(state, items):
+    complete = []
+    sub = functools.partial(sre_parse.SubPattern, state)
+    for op, av in items:
+        if op in [sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT]:
+            continue
+        elif op == sre_parse.SUBPATTERN:
+            complete.append((op, (None, av[1], av[2], sub(complete_items(state, av[3])))))
+        elif op in REPEATS:
+            complete.append((sre_parse.MAX_REPEAT, (av[0], av[1], sub(complete_items(state, av[2])))))
+        elif op == sre_parse.BRANCH:
+            complete.append((op, (None, [sub(complete_items(state, branch)) for branch in av[1]])))
+        elif op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+            complete.append((sre_parse.SUBPATTERN, (None, 0, 0, sub(complete_items(state, av)))))
+        elif op == sre_parse.GROUPREF_EXISTS:
+            branches = [branch or [] for branch in av[1:]]
+            complete.append((sre_parse.BRANCH, (None, [sub(complete_items(state, branch)) for branch in branches])))
+        elif op == sre_parse.GROUPREF:
+            complete.extend(anything(state))
+        else:
+            complete.append((op, av))
+    return complete
+
+
+def anything(state):
+    any_char = (sre_parse.IN, [(sre_parse.CATEGORY, sre_parse.CATEGORY_SPACE),
+                               (sre_parse.CATEGORY, sre_parse.CATEGORY_NOT_SPACE)])
+    return [(sre_parse.MAX_REPEAT, (0, sre_parse.MAXREPEAT, sre_parse.SubPattern(state, [any_char])))]
+
+
+def set_has_newline(items):
+    newline = ord('\n')
+    negate = found = False
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            found = found or av == newline
+        elif op == sre_parse.RANGE:
+            found = found or av[0] <= newline <= av[1]
+        elif op == sre_parse.CATEGORY:
+            found = found or av not in SINGLE_LINE_CATEGORIES
+        else:
+            return True
+    return found != negate
+
+
+def iter_literal_blocks(args, blocks, cmd):
+    literal, replacement = cmd.literal, cmd.literal_replacement
+    if args.profiler is not None:
+        blocks = args.profiler.counting(cmd, blocks, lambda block: block.count(literal))
+    for block in blocks:
+        if has_other_separators(block):
+            yield '\n'.join([line.replace(literal, replacement) for line in block.splitlines()]) + '\n'
+        else:
+            yield block.replace(literal, replacement)
+
+
+def iter_regex_blocks(args, blocks, cmd):
+    # the line ending of the last line is left out so an empty match cannot follow it
+    multiline = PATTERNS.get(cmd.pattern.pattern, cmd.pattern.flags | re.MULTILINE, count=False).pattern
+    subn = functools.partial(multiline.subn, cmd.replacement)
+    line_subn = functools.partial(cmd.pattern.subn, cmd.replacement)
+    profiler = args.profiler
+    # the regular expression engine jumps to a literal prefix by itself, faster than jumping between guards
+    guard = '' if get_literal_prefix(cmd.pattern) else cmd.guard
+    for block in blocks:
+        if has_other_separators(block):
+            results = [line_subn(line) for line in block.splitlines()]
+            block, count = '\n'.join([line for line, _ in results]), sum(count for _, count in results)
+        elif guard and block.count(guard) * GUARD_GAP < len(block):
+            block, count = guarded_block_subn(subn, guard, block[:-1])
+        else:
+            block, count = subn(block[:-1])
+        if count and profiler is not None:
+            profiler.count(cmd, count)
+        yield block + '\n'
+
+
+def guarded_block_subn(subn, guard, text):
+    # hits less than GUARD_GAP apart are substituted together
+    find = text.find
+    pos = find(guard)
+    if pos < 0:
+        return text, 0
+    out = []
+    total = start = 0
+    while pos >= 0:
+        region = text.rfind('\n', start, pos) + 1
+        last = pos
+        pos = find(guard, last + len(guard))
+        while 0 <= pos - last <= GUARD_GAP:
+            last = pos
+            pos = find(guard, last + len(guard))
+        end = find('\n', last)
+        if end < 0:
+            end = len(text)
+        if 0 <= pos < end:
+            pos = find(guard, end)
+        region_text, count = subn(text[region:end])
+        out += [text[start:region], region_text]
+        total += count
+        start = end
+    out.append(text[start:])
+    return ''.join(out), total
+
+
+def iter_line_blocks(chunks):
+    # an unterminated last line is given a \n unless it ends with another separator
+    partial = ''
+    for chunk in chunks:
+        text = partial + chunk
+        cut = text.rfind('\n') + 1
+        partial = text[cut:]
+        if cut:
+            yield text[:cut]
+    if partial:
+        yield partial if partial[-1] in OTHER_SEPARATORS else partial + '\n'
+
+
+def iter_window_lines(chunks):
+    # a window is counted in lines, so text from another window stage or a piece table is cut again at each \n
+    parts = []
+    for chunk in chunks:
+        start = 0
+        end = chunk.find('\n') + 1
+        while end:
+            if parts:
+                parts.append(chunk[start:end])
+                yield ''.join(parts)
+                parts = []
+            else:
+                yield chunk[start:end]
+            start = end
+            end = chunk.find('\n', start) + 1
+        if start < len(chunk):
+            parts.append(chunk[start:])
+    if parts:
+        yield ''.join(parts)
+
+
+def iter_block_lines(blocks):
+    for block in blocks:
+        yield from block.splitlines()
+
+
+def chain_line_stages(args, data, commands):
+    # consecutive filters are fused, leading line-local substitutions run on blocks, line numbers use an index
+    profiler = args.profiler
+    while (isinstance(data, (str, Segments)) and commands and commands[0].op in INDEXED_COMMANDS
+           and can_index_lines(args, data, commands[0])):
+        data = run_handler(args, data, commands[0])
+        commands = commands[1:]
+    if not commands:
+        return data
+    if isinstance(data, (str, TextChunks)) and is_block_stage(args, commands[0]):
+        blocks = iter_line_blocks(as_text_stream(args, data))
+        while commands and is_block_stage(args, commands[0]):
+            blocks = get_block_stage(args, commands[0])(args, blocks, commands[0])
+            if profiler is not None:
+                blocks = profiler.stream(profiler.command_stage(commands[0]), blocks, text=True)
+            commands = commands[1:]
+        data = iter_block_lines(blocks)
+    if profiler is not None and commands:
+        profiler.command_stage(commands[0])
+    lines = as_line_stream(args, data)
+    # filters are profiled one command at a time
+    fuse = profiler is None
+    for fused, group in itertools.groupby(commands, lambda cmd: fuse and cmd.op in FUSED_FILTERS):
+        group = list(group)
+        if fused and len(group) > 1:
+            lines = iter_fused_filters(args, lines, group)
+        else:
+            for cmd in group:
+                lines = LINE_STAGES[cmd.op](args, lines, cmd)
+                if not args.eof:
+                    lines = iter_split_end(lines)
+                if profiler is not None:
+                    lines = profiler.stream(profiler.command_stage(cmd), lines)
+    return lines
+
+
+def iter_fused_filters(args, lines, commands):
+    # a line is dropped by the first filter rejecting it
+    checks = [(get_check(args, cmd), cmd.op in [FILTER, LINE_FILTER]) for cmd in combine_excludes(args, commands)]
+    if len(checks) == 1:
+        check, keep = checks[0]
+        return (line for line in lines if bool(check(line)) == keep)
+    return iter_checked_lines(lines, checks)
+
+
+def iter_checked_lines(lines, checks):
+    for line in lines:
+        for check, keep in checks:
+            if bool(check(line)) != keep:
+                break
+        else:
+            yield line
+
+
+def combine_excludes(args, commands):
+    # patterns without group references or inline flags are combined into one alternation
+    combined = []
+    for cmd in commands:
+        previous = combined[-1] if combined else None
+        if (cmd.op == EXCLUDE and previous is not None and previous.op == EXCLUDE
+                and can_alternate(cmd.pattern) and can_alternate(previous.pattern)):
+            pattern = compile_pattern(args, f'(?:{previous.pattern.pattern})|(?:{cmd.pattern.pattern})')
+            combined[-1] = previous._replace(item=f'{previous.item} {cmd.item}', pattern=pattern,
+                                               literal=None, guard=get_required_literal(pattern))
+        else:
+            combined.append(cmd)
+    return combined
+
+
+def can_alternate(pattern):
+    return '(?' not in pattern.pattern.replace('(?:', '') and not re.search(r'\\\d', pattern.pattern)
+
+
+def line_sub(args, data, cmd):
+    lines = iter_line_sub(args, get_lines(args, data), cmd)
+    return list(lines if args.eof else iter_split_end(lines))
+
+
+def iter_line_sub(args, lines, cmd):
+    subn = get_line_subn(args, cmd)
+    split = False
+    if args.maxsub > 0:
+        maxsub = args.maxsub
+        subs = maxsub if args.maxlinesub == 0 else min(maxsub, args.maxlinesub)
+        for line in lines:
+            if maxsub > 0:
+                line, count = subn(line, count=min(subs, maxsub))
+                maxsub -= count
+                if count and '\n' in line:
+                    yield from split_text(line)
+                    split = True
+                    continue
+            yield line
+        if args.profiler is not None:
+            args.profiler.count(cmd, args.maxsub - maxsub)
+    else:
+        maxlinesub = args.maxlinesub
+        profiler = args.profiler
+        for line in lines:
+            line, count = subn(line, count=maxlinesub)
+            if count and profiler is not None:
+                profiler.count(cmd, count)
+            if '\n' in line:
+                yield from split_text(line)
+                split = True
+            else:
+                yield line
+    return split
+
+
+def file_sub(args, data, cmd):
+    text = get_string(args, data)
+    if literal_mode(args, cmd) == LITERAL_EXACT and cmd.literal_replacement is not None:
+        if args.profiler is not None:
+            count = text.count(cmd.literal)
+            args.profiler.count(cmd, min(count, args.maxsub) if args.maxsub > 0 else count)
+        return text.replace(cmd.literal, cmd.literal_replacement, args.maxsub or -1)
+    text, count = cmd.pattern.subn(cmd.replacement, text, count=args.maxsub)
+    if args.profiler is not None:
+        args.profiler.count(cmd, count)
+    return text
+
+
+def iter_window_sub(args, chunks, cmd):
+    # at most the first half of the window is written on each step, never text a match attempt still covers
+    size, pattern, r = args.window, cmd.pattern, cmd.replacement
+    expand = r if callable(r) else (lambda match: match.expand(r))
+    running = PATTERNS.analyze(pattern).partial if can_span_lines(pattern) else None
+    commit_lines = size - size // 2
+    remaining = args.maxsub if args.maxsub > 0 else -1
+    source = iter(chunks)
+    pieces = []
+    partial = 0
+    context = ''
+    line_no = 1
+    ended = False
+    while True:
+        for piece in source:
+            pieces.append(piece)
+            if len(pieces) >= size + partial:
+                break
+        exhausted = ended or len(pieces) < size + partial
+        buf = context + ''.join(pieces)
+        start = pos = len(context)
+        if exhausted:
+            limit = safe_end = len(buf) + 1
+        else:
+            limit = start + sum(len(piece) for piece in pieces[:commit_lines + partial])
+            safe_end = len(buf) - len(pieces[-1]) if running is None else len(buf)
+        out = []
+        deferred = None
+        # a match attempt still running at the end of the buffer could match differently with more text
+        alive = get_alive(running, buf, start, exhausted)
+        for match in pattern.finditer(buf, start):
+            if remaining == 0 or match.start() >= min(limit, alive):
+                break
+            if match.end() > safe_end:
+                deferred = match
+                break
+            out.append(buf[pos:match.start()])
+            out.append(expand(match))
+            pos = match.end()
+            remaining -= 1
+            if alive < pos:
+                alive = get_alive(running, buf, pos, exhausted)
+        if exhausted or remaining == 0:
+            out.append(buf[pos:])
+            if args.profiler is not None:
+                args.profiler.count(cmd, (args.maxsub if args.maxsub > 0 else -1) - remaining)
+            yield ''.join(out)
+            yield from source
+            return
+        commit = deferred.start() if deferred else max(pos, min(limit, alive))
+        if commit == start:
+            # the window may just hold the rest of the input
+            ended = next(source, None) is None
+            if ended:
+                continue
+            raise PedError(f'Error: a match starting on line {line_no} of the "{cmd.item}" command may span more '
+                           f'than the --window of {size} lines', PedErrorTypes.PED_OTHER_ERROR)
+        out.append(buf[pos:commit])
+        yield ''.join(out)
+        offset = start
+        for index, piece in enumerate(pieces):
+            if offset + len(piece) > commit:
+                break
+            offset += len(piece)
+        line_no += index
+        context = buf[offset:commit] if commit > offset else pieces[index - 1]
+        pieces = [buf[commit:offset + len(piece)]] + pieces[index + 1:]
+        partial = 1 if commit > offset else 0
+
+
+def get_alive(running, buf, pos, exhausted):
+    match = None if exhausted or running is None else running.search(buf, pos)
+    return len(buf) + 1 if match is None or match.start() == len(buf) else match.start()
+
+
+def file_only(args, data, cmd):
+    if literal_mode(args, cmd) == LITERAL_EXACT:
+        count = get_string(args, data).count(cmd.literal)
+        if args.profiler is not None:
+            args.profiler.count(cmd, count)
+        return cmd.literal * count
+    matches = [match[0] for match in cmd.pattern.finditer(get_string(args, data))]
+    if args.profiler is not None:
+        args.profiler.count(cmd, len(matches))
+    return ''.join(matches)
+
+
+LINE_STAGES = {
+    LINE_SUB: iter_line_sub, LINE_FIXED_SUB: iter_line_sub,
+    **{op: iter_filter_lines for op in ALL_FILTERS},
+    **{op: iter_xform_lines for op in [LINE_UPPER, LINE_LOWER, LINE_TITLE, LINE_CAPITALIZE]},
+    LINE_APPEND: iter_append_prepend_line, LINE_PREPEND: iter_append_prepend_line,
+    LINE_INSERT: iter_insert_line, LINE_REPLACE: iter_replace_lines, LINE_DELETE: iter_delete_lines,
+}
+
+WINDOW_STAGES = {
+    FILE_SUB: iter_window_sub, FILE_REMOVE: iter_window_sub,
+    **{op: iter_window_sub for op in [FILE_UPPER, FILE_LOWER, FILE_TITLE, FILE_CAPITALIZE]},
+}
+
+FUSED_FILTERS = {
+    FILTER: lambda pattern: pattern.search, LINE_FILTER: lambda pattern: pattern.fullmatch,
+    EXCLUDE: lambda pattern: pattern.search, LINE_EXCLUDE: lambda pattern: pattern.fullmatch,
+}
+
+INDEXED_COMMANDS = [LINE_INSERT, LINE_REPLACE, LINE_DELETE]
+BLOCK_COMMANDS = [LINE_SUB, LINE_FIXED_SUB, LINE_REMOVE, LINE_UPPER, LINE_LOWER, LINE_TITLE, LINE_CAPITALIZE]
+
+HANDLERS = {
+    FILE_SUB: file_sub, FILE_REMOVE: file_sub, FILE_ONLY: file_only,
+    LINE_SUB: line_sub, LINE_FIXED_SUB: line_sub,
+    **{op: filter_lines for op in ALL_FILTERS},
+    **{op: xform_lines for op in [LINE_UPPER, LINE_LOWER, LINE_TITLE, LINE_CAPITALIZE]},
+    **{op: xform_file for op in [FILE_UPPER, FILE_LOWER, FILE_TITLE, FILE_CAPITALIZE]},
+    LINE_APPEND: append_prepend_line, LINE_PREPEND: append_prepend_line,
+    FILE_APPEND: append_prepend_characters, FILE_PREPEND: append_prepend_characters,
+    LINE_INSERT: insert_line, FILE_INSERT: insert_chars,
+    LINE_REPLACE: replace_lines, FILE_REPLACE: replace_chars,
+    LINE_DELETE: delete_lines, FILE_DELETE: delete_chars,
+}
+
+
+def can_map(args: argparse.Namespace, commands):
+    # a pattern that can match part of a multibyte character needs an ASCII file, \r would be translated as text
+    if not args.mmap or args.path == '-' or args.normalize or not commands:
+        return False
+    cmd = commands[0]
+    if cmd.op not in MAPPED_COMMANDS or not cmd.pattern.pattern.isascii() or os.path.getsize(args.path) == 0:
+        return False
+    with open(args.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm.find(b'\r') >= 0:
+            return False
+        return not PATTERNS.analyze(cmd.pattern).uses_unicode or is_ascii(mm)
+
+
+def is_ascii(data):
+    return NON_ASCII.search(data) is None
+
+
+NON_ASCII = re.compile(rb'[\x80-\xff]')
+
+
+def iter_mapped(args: argparse.Namespace, cmd):
+    # yields slices of the map between matches instead of building a new string
+    pattern = PATTERNS.get(cmd.pattern.pattern.encode('utf-8'), cmd.pattern.flags & ~re.UNICODE,
+                           count=False).pattern
+    with open(args.path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    # the map is not closed explicitly, it is released along with the last slice handed out
+    view = memoryview(mm)
+    if cmd.op == FILE_ONLY:
+        for match in pattern.finditer(mm):
+            yield view[match.start():match.end()]
+        return
+    template = cmd.replacement.encode('utf-8')
+    remaining = args.maxsub if args.maxsub > 0 else -1
+    pos = 0
+    for match in pattern.finditer(mm):
+        if remaining == 0:
+            break
+        yield view[pos:match.start()]
+        yield match.expand(template)
+        pos = match.end()
+        remaining -= 1
+    yield view[pos:]
+
+
+def iter_decoded(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    yield decoder.decode(b'', final=True)
+
+
+MAPPED_COMMANDS = [FILE_SUB, FILE_REMOVE, FILE_ONLY]
+
+# commands that leave the text as it is when their pattern does not match
+PRESCAN_COMMANDS = [LINE_SUB, FILE_SUB, LINE_FIXED_SUB, LINE_REMOVE, FILE_REMOVE, EXCLUDE, LINE_EXCLUDE, *XFORMS]
+
+
+def can_prescan(args: argparse.Namespace, commands):
+    # every command does nothing without a match and has a pattern that requires a literal
+    return bool(commands) and all(cmd.op in PRESCAN_COMMANDS and cmd.guard for cmd in commands)
+
+
+def is_unchanged(args: argparse.Namespace, commands, data):
+    # none of the commands can fire without its literal, find also works on a memory map
+    if args.ending != '\n' or (len(data) and (data[-1:] in ['\n', b'\n']) != args.eof):
+        return False
+    texts = [*OTHER_SEPARATORS, *(cmd.guard for cmd in commands)]
+    if not isinstance(data, str):
+        texts = [text.encode('utf-8') for text in texts]
+    return all(data.find(text) < 0 for text in texts)
+
+
+def prescan(args: argparse.Namespace, commands):
+    # the file is still checked to be valid UTF-8
+    if os.linesep != '\n':
+        return None
+    with open(args.path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+    if not is_unchanged(args, commands, data):
+        return None
+    view = memoryview(data)
+    for _ in iter_decoded(view[start:start + CHUNK_SIZE] for start in range(0, size, CHUNK_SIZE)):
+        pass
+    return view
+
+
+class ProfileStage:
+
+    def __init__(self, label, ops=()):
+        self.label = label
+        self.ops = ops
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.lines = None
+        self.bytes = None
+        self.matches = None
+        self.conversions = 0
+        self.upstream = None
+
+    def add_output(self, lines, size):
+        self.lines = (self.lines or 0) + lines
+        self.bytes = (self.bytes or 0) + size
+
+
+class Profile:
+    # a lazy stage is timed while its output is pulled, the time of the stage feeding it is subtracted
+    batch_size = 4096
+
+    def __init__(self, args: argparse.Namespace):
+        self.ending = len(args.ending.encode('utf-8'))
+        self.stages = {}
+        self.by_command = {}
+        self.current = None
+        self.last_stream = None
+        self.started = time.perf_counter()
+        self.pattern_lookups = (PATTERNS.hits, PATTERNS.misses)
+
+    def stage(self, label, commands=()):
+        # created the first time so totals add up over several files
+        key = (label, *(id(cmd) for cmd in commands))
+        if key not in self.stages:
+            self.stages[key] = ProfileStage(label, tuple(cmd.op for cmd in commands))
+            for cmd in commands:
+                self.by_command[id(cmd)] = self.stages[key]
+        self.current = self.stages[key]
+        return self.current
+
+    def command_stage(self, cmd):
+        return self.stage(cmd.item, [cmd])
+
+    def call(self, stage, function, *args):
+        stage.upstream, self.last_stream = self.last_stream, None
+        self.current = stage
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(*args)
+        stage.wall += time.perf_counter() - wall
+        stage.cpu += time.process_time() - cpu
+        self.measure(stage, result)
+        return result
+
+    def stream(self, stage, items, text=False):
+        stage.upstream, self.last_stream = self.last_stream, stage
+        return self.iter_timed(stage, iter(items), text)
+
+    def stream_input(self, data):
+        stage = self.stage('(read)')
+        if isinstance(data, TextChunks):
+            return TextChunks(self.stream(stage, data, text=True))
+        return self.stream(stage, data)
+
+    def iter_timed(self, stage, items, text):
+        lines = size = 0
+        try:
+            while True:
+                wall, cpu = time.perf_counter(), time.process_time()
+                batch = list(itertools.islice(items, self.batch_size))
+                stage.wall += time.perf_counter() - wall
+                stage.cpu += time.process_time() - cpu
+                if not batch:
+                    return
+                if text:
+                    lines += sum(count_newlines(item) for item in batch)
+                    size += sum(text_size(item) for item in batch)
+                else:
+                    lines += len(batch)
+                    size += sum(text_size(line) for line in batch) + self.ending * len(batch)
+                yield from batch
+        finally:
+            stage.add_output(lines, size)
+
+    def materialize(self, data):
+        # so the buffered command it feeds is timed on its own
+        if isinstance(data, (str, list, Segments, Document)):
+            pass
+        elif isinstance(data, TextChunks):
+            data = type(data)(list(data))
+        else:
+            data = list(data)
+        self.last_stream = None
+        return data
+
+    def measure(self, stage, data):
+        data = get_form(data)
+        if isinstance(data, list):
+            stage.add_output(len(data), sum(text_size(line) for line in data) + self.ending * len(data))
+        elif isinstance(data, str):
+            stage.add_output(len(data.splitlines()), text_size(data))
+        elif isinstance(data, Segments):
+            stage.add_output(sum(count_newlines(chunk) for chunk in data), sum(text_size(chunk) for chunk in data))
+
+    def count(self, cmd, matches):
+        stage = self.by_command.get(id(cmd))
+        if stage is not None:
+            stage.matches = (stage.matches or 0) + matches
+
+    def counting(self, cmd, items, count):
+        for item in items:
+            self.count(cmd, count(item))
+            yield item
+
+    def conversions(self):
+        if self.current is not None:
+            self.current.conversions += 1
+
+    def get_rows(self):
+        rows = []
+        previous = None
+        for stage in self.stages.values():
+            wall, cpu = stage.wall, stage.cpu
+            if stage.upstream is not None:
+                wall, cpu = wall - stage.upstream.wall, cpu - stage.upstream.cpu
+            lines_in, bytes_in = (previous.lines, previous.bytes) if previous else (None, None)
+            matches = stage.matches
+            if matches is None and stage.lines is not None and len(stage.ops) == 1:
+                if stage.ops[0] in [FILTER, LINE_FILTER, LINE_ONLY]:
+                    matches = stage.lines
+                elif stage.ops[0] in [EXCLUDE, LINE_EXCLUDE] and lines_in is not None:
+                    matches = lines_in - stage.lines
+            rows.append({'command': stage.label, 'wall': max(wall, 0.0), 'cpu': max(cpu, 0.0),
+                         'lines_in': lines_in, 'lines_out': stage.lines, 'bytes_in': bytes_in,
+                         'bytes_out': stage.bytes, 'matches': matches, 'conversions': stage.conversions})
+            previous = stage if stage.lines is not None else previous
+        return rows
+
+    def get_pattern_cache(self):
+        hits, misses = self.pattern_lookups
+        return {'hits': PATTERNS.hits - hits, 'misses': PATTERNS.misses - misses, 'entries': len(PATTERNS.entries),
+                'size': PATTERNS.size}
+
+    def report(self, stream, fmt):
+        rows = self.get_rows()
+        total = time.perf_counter() - self.started
+        cache = self.get_pattern_cache()
+        if fmt == 'json':
+            import json
+            stream.write(json.dumps({'wall': total, 'stages': rows, 'pattern_cache': cache}, indent=2) + '\n')
+            return
+        columns = ['command', 'wall ms', 'cpu ms', 'lines in', 'lines out', 'bytes in', 'bytes out', 'matches',
+                   'conversions']
+        table = [[row['command'], f"{row['wall'] * 1000:.1f}", f"{row['cpu'] * 1000:.1f}"]
+                 + ['-' if row[key] is None else str(row[key])
+                    for key in ['lines_in', 'lines_out', 'bytes_in', 'bytes_out', 'matches', 'conversions']]
+                 for row in rows]
+        table.append(['total', f'{total * 1000:.1f}'] + [''] * (len(columns) - 2))
+        widths = [max(len(line[n]) for line in [columns] + table) for n in range(len(columns))]
+        for line in [columns] + table:
+            stream.write('  '.join([line[0].ljust(widths[0])]
+                                   + [cell.rjust(width) for cell, width in zip(line[1:], widths[1:])]).rstrip())
+            stream.write('\n')
+        stream.write(f"pattern cache: {cache['hits']} hits, {cache['misses']} misses, {cache['entries']} of "
+                     f"{cache['size']} entries\n")
+
+
+def count_newlines(text):
+    return text.count('\n') if isinstance(text, str) else bytes(text).count(b'\n')
+
+
+def text_size(text):
+    if isinstance(text, str):
+        return len(text) if text.isascii() else len(text.encode('utf-8'))
+    return len(text)
+
+
+def get_file_contents(path):
+    f = open(path, encoding="utf-8")
+    data = f.read()
+    f.close()
+    return data
+
+
+class CustomFormatter(argparse.HelpFormatter):
+    def __init__(self, prog, indent_increment=2, max_help_position=24, width=None):
+        # argparse makes a formatter for every argument added, its default width comes from shutil which imports
+        # the compression modules, so the terminal is asked directly
+        super().__init__(prog, indent_increment, max_help_position, width or get_terminal_width() - 2)
+
+    # noinspection PyMethodMayBeStatic
+    def _flow(self, text):
+        lines = text.splitlines()
+        new_text = lines[0]
+        last = True
+        for line in lines[1:]:
+            cur = line.strip() != '' and line[0] != ' '
+            new_text += (' ' if last and cur else os.linesep) + line
+            last = cur
+        return new_text
+
+    def _format_text(self, text):
+        import textwrap
+        text_width = max(self._width - self._current_indent, 11)
+        indent = ' ' * self._current_indent
+        if '<mark-over>' in text:
+            lines = []
+            for line in self._flow(text).splitlines():
+                line = re.sub(r'<mark-over>', '', line)
+                if line.strip() == '':
+                    lines.append(line)
+                elif line[0] == ' ':
+                    spaces = (len(line) - len(line.lstrip()))
+                    lines = lines + textwrap.wrap(line.lstrip(), text_width, initial_indent=' ' * spaces,
+                                                  subsequent_indent=' ' * spaces * 2)
+                else:
+                    line = re.sub(r'\s{2,}', ' ', line)
+                    lines = lines + textwrap.wrap(line, text_width, initial_indent=indent, subsequent_indent=indent)
+            return os.linesep.join(lines) + '\n\n'
+
+
+def get_terminal_width():
+    # the width shutil.get_terminal_size() would give, $COLUMNS or the size of stdout or 80
+    try:
+        return int(os.environ['COLUMNS'])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return os.get_terminal_size(sys.__stdout__.fileno()).columns or 80
+    except (AttributeError, ValueError, OSError):
+        return 80
+
+
+class PedErrorTypes(IntEnum):
+    PED_UNKNOWN_COMMAND_ERROR = 2
+    PED_IO_ERROR = 2
+    PED_RE_ERROR = 3
+    PED_OTHER_ERROR = 4
+
+
+class PedError(Exception):
+    def __init__(self, message, error_type):
+        super().__init__(message)
+        self.msg = message
+        self.type = error_type
+
+    def __reduce__(self):
+        return PedError, (self.msg, self.type)
+
+
+def use_color(args, stream=sys.stdout):
+    supported_platform = (sys.platform != 'win32' or 'ANSICON' in os.environ)
+    is_a_tty = hasattr(stream, 'isatty') and sys.stdout.isatty()
+    return args.color is True or (supported_platform and is_a_tty and args.color is not False)
+
+
+def catching_main(argv):
+    try:
+        return main(argv)
+    except PedError:
+        raise
+    except Exception as ex:
+        raise get_ped_error(ex) from ex
+
+
+def get_ped_error(ex):
+    if isinstance(ex, re.error):
+        return PedError(f'''Error: regular expression invalid - '''
+                        f'''{ex.msg if hasattr(ex, "msg") else "???"}'''
+                        f'''{f' : "{ex.pattern}"' if hasattr(ex, 'pattern') else ''}''', PedErrorTypes.PED_RE_ERROR)
+    if isinstance(ex, FileNotFoundError):
+        return PedError(f'Error: file not found' + (f' - "{ex.filename}"' if hasattr(ex, 'filename') else ''),
+                        PedErrorTypes.PED_IO_ERROR)
+    if isinstance(ex, PermissionError):
+        return PedError(f'Error: permissions error', PedErrorTypes.PED_IO_ERROR)
+    if isinstance(ex, OSError):
+        fn = f'''{"" if ex.filename is None else f' "{ex.filename}" '}'''
+        error_type = PedErrorTypes.PED_OTHER_ERROR if ex.filename is None else PedErrorTypes.PED_IO_ERROR
+        return PedError(f'Error: [{ex.errno}] {ex.strerror}{fn}', error_type)
+    if hasattr(ex, 'strerror'):
+        msg = f'- {ex.strerror}'
+    elif hasattr(ex, 'msg'):
+        msg = f'- {ex.msg}'
+    elif hasattr(ex, 'message'):
+        msg = f'- {ex.message}'
+    else:
+        msg = 'unknown'
+    return PedError(f'Error: unexpected error - {msg}', PedErrorTypes.PED_OTHER_ERROR)
+
+
+def cli(argv):
+    rc = 0
+    try:
+        rc = catching_main(argv) or 0
+    except PedError as pex:
+        print(pex.msg, file=sys.stderr)
+        rc = pex.type
+    return int(rc)
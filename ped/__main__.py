@@ -0,0 +1,6 @@
+import sys
+
+from ped import cli
+
+if __name__ == '__main__':
+    sys.exit(cli(sys.argv[1:]))
@@ -1,12 +1,19 @@
+import errno
+import datetime
+import functools
 import os
 import sys
-import glob
 import random
+import json
 import shutil
+import socket
+import subprocess
 import tempfile
-from io import StringIO
+import time
+import unittest
+from io import StringIO, BytesIO, TextIOWrapper
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 from stat import S_IREAD, S_IRGRP, S_IROTH
 import ped
 
@@ -42,6 +49,7 @@ class TestPed(TestCase):
 
 
 short_text = 'this is a test\nof this thing here \nand you might be special.'
+python_text = 'Python is fun\nthe python way\n\n3 ms timeout in step 4\nthe end'
 
 
 class TestOptions(TestPed):
@@ -141,12 +149,15 @@ class TestOptions(TestPed):
             before = file_get_contents(temp_inplace)
             self.assertEqual(short_text, before)
             self.run_args(['-e', opt, temp_path, '-f', temp_inplace, 's/[aeiou]/-'])
-            file_list = glob.glob(os.path.join(temp_path, '*'))
-            self.assertEqual(len(file_list), 1)
-            backup = file_get_contents(file_list[0])
+            store = ped.BackupStore(temp_path)
+            entries = store.get_entries()
+            self.assertEqual(len(entries), 1)
+            backup = b''.join(store.iter_blob(entries[0])).decode('utf-8')
             self.assertEqual(before, backup)
             after = file_get_contents(temp_inplace)
             self.assertNotEqual(before, after)
+            shutil.rmtree(temp_path)
+            os.unlink(temp_inplace)
 
     def test_no_eof(self):
         out = self.run_piped(['s/[aeiou]/-'], 'abcdefghi\njklmnopqrs\ntuvwxyz')
@@ -447,6 +458,1165 @@ class TestMultipleCommands(TestPed):
         self.assertEqual(out, '> a\n> xx\n> yy\n> zz\n> c\n')
 
 
+class TestWindow(TestPed):
+    text = ''.join(f'line {i} Fred\n{" " * (i % 3)}Flintstone {"Fred " * (i % 4)}was here\n' for i in range(40)) + 'end'
+
+    def test_window_matches_buffered(self):
+        commands = [[r'S/Fred(\s+)Flintstone/Barney\1Rubble'], [r'R/\s+'], ['-m', r'S/^\s*(\w)/<\1>'],
+                    ['-i', r'U/fred\s+f'], [r'S/\bwas\b/WAS/', 'g/WAS', r'C/\d+\s+\w'], ['-M', '7', r'S/e\s/E_'],
+                    ['-Z', r'S/\n/ ', 's/1/one/'], ['-n', r'S/d$/D'], [r'S/x*/-']]
+        for argv in commands:
+            expected = self.run_piped(argv, self.text)
+            for size in [2, 3, 4, 10, 1000]:
+                with self.subTest(argv=argv, size=size):
+                    self.assertEqual(self.run_piped(['--window', str(size)] + argv, self.text), expected)
+        text = 'line 0 Fred\nFlintstone was here\nline 1 Fred\n  Flintstone Fred was here\nend'
+        for argv, out in [([r'S/Fred(\s+)Flintstone/Barney\1Rubble'],
+                           'line 0 Barney\nRubble was here\nline 1 Barney\n  Rubble Fred was here\nend'),
+                          ([r'R/\s+'], 'line0FredFlintstonewashereline1FredFlintstoneFredwashereend'),
+                          (['-M', '1', r'S/e\s/E_'],
+                           'linE_0 Fred\nFlintstone was here\nline 1 Fred\n  Flintstone Fred was here\nend'),
+                          (['-Z', r'S/\n/ ', 's/1/one/'],
+                           'line 0 Fred Flintstone was here line one Fred   Flintstone Fred was here end')]:
+            for size in [2, 3, 10]:
+                with self.subTest(argv=argv, size=size):
+                    self.assertEqual(self.run_piped(['--window', str(size)] + argv, text), out)
+
+    def test_window_longer_matches(self):
+        self.assertEqual(self.run_piped(['--window', '4', r'S/a\s+b/X/'], 'a\n\n\nb'), 'X')
+        self.assertEqual(self.run_piped(['--window', '3', r'S/a\s+b/X/'], 'a\nb\na\n\nb\nc\n'), 'X\nX\nc\n')
+        self.assertEqual(self.run_piped(['--window', '3', r'S/x\s*/-/'], 'x\n\ny\nx\n'), '-y\n-')
+        self.assertEqual(self.run_piped(['--window', '3', r'S/b|a\s+c/X/'], 'a\nb\na\n\nb\n'), 'a\nX\na\n\nX\n')
+        text = 'a\n\n\nb a\nb\n'
+        for argv in [['-M', '1', r'S/a\s+b|a/X/'], ['-M', '2', r'S/a\s+b/X/'], ['-M', '1', r'S/a\s*/-/']]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_piped(['--window', '4'] + argv, text), self.run_piped(argv, text))
+        self.assertEqual(self.run_piped(['--window', '4', '-M', '1', r'S/a\s+b|a/X/'], text), 'X a\nb\n')
+
+    def test_window_chained(self):
+        text = '# c\n' * 20 + 'Fred\nFlintstone\n'
+        argv = ['-m', '--window', '4', 'R/^#.*\\n/', 'S/Fred\\s+Flintstone/BR/']
+        self.assertEqual(self.run_piped(argv, text), 'BR\n')
+        self.assertEqual(self.run_piped(['--window', '2', 'R/[^a]/', 'L/A/'], 'a\nb\n'), 'a')
+        for argv in [[r'R/\s+', r'S/Fred(\w)/<\1>'], [r'S/Fred\s+/', r'U/^\w+\s'],
+                     ['-M', '9', r'S/e\s/E\n\n', 'S/E/e']]:
+            for size in [2, 3, 10]:
+                with self.subTest(argv=argv, size=size):
+                    self.assertEqual(self.run_piped(['--window', str(size)] + argv, self.text),
+                                     self.run_piped(argv, self.text))
+
+    def test_window_streams(self):
+        with patch('sys.stdout', new=StringIO()) as stdout:
+            feed = LineFeed(self.text, stdout)
+            with patch('sys.stdin', new=feed):
+                self.ped.catching_main(['-W', '4', r'S/Fred\s+Flintstone/Barney Rubble'])
+        self.assertTrue(feed.seen[-1].startswith('line 0 Barney Rubble'))
+        self.assertEqual(stdout.getvalue().count('Barney Rubble'), 40)
+
+    def test_window_too_small(self):
+        with self.assertRaises(ped.PedError) as ex:
+            self.run_piped(['-W', '4', '-d', r'S/line 1 .*/'], self.text)
+        self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_OTHER_ERROR)
+        self.assertIn('line 3 of the', ex.exception.msg)
+        self.assertIn('may span more than the --window of 4 lines', ex.exception.msg)
+        expected = self.run_piped(['-d', r'S/line 1 .*?line 3/'], self.text)
+        self.assertEqual(self.run_piped(['-W', '8', '-d', r'S/line 1 .*?line 3/'], self.text), expected)
+        with self.assertRaises(ped.PedError):
+            self.run_piped(['--window', '2', r'S/a\s+b/X/'], 'a\n\n\nb')
+        with self.assertRaises(ped.PedError):
+            self.run_piped(['--window', '2', r'S/a(?:\n|x)*b/X/'], 'a\n\n\nb\n')
+        with self.assertRaises(SystemExit):
+            self.run_piped(['-W', '1', r'S/a/b'], self.text, err=True)
+
+
+class TestMmap(TestPed):
+
+    def test_mmap_matches_text(self):
+        for argv in [[r'O/\b\w{7}\b'], ['-dm', r'R/\b\w{2,5}\b( |\n|$|\.)+/'], ['-i', r'S/PYTHON\s+(\w+)/<\1>'],
+                     ['-M', '3', 'S/o/0/'], ['-F', 'S/.//'], ['O/[A-Z]\\w+', 's/^/> '], ['S/e/\n', 'g/^s']]:
+            for path in [short_path, long_path]:
+                with self.subTest(argv=argv, path=path):
+                    self.assertEqual(self.run_args(['--mmap', '-f', path] + argv), self.run_args(['-f', path] + argv))
+        for argv, out in [([r'O/\b\w{7}\b'], 'special'),
+                          (['-M', '3', 'S/o/0/'], 'this is a test\n0f this thing here \nand y0u might be special.'),
+                          (['-i', r'S/THIS\s+(\w+)/<\1>'], '<is> a test\nof <thing> here \nand you might be special.'),
+                          (['S/e/\n', 'g/^s'], 'st\n')]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_args(['--mmap', '-f', short_path] + argv), out)
+
+    def test_mmap_binary_stdout(self):
+        with tempfile.TemporaryDirectory('_mmap') as temp_dir:
+            temp_path = os.path.join(temp_dir, 'lf.txt')
+            with open(temp_path, 'wb') as f:
+                f.write('Fred\n  Flintstone caf\u00e9\n'.encode('utf-8'))
+            with patch('sys.stdout', new=TextIOWrapper(BytesIO(), encoding='utf-8')) as stdout:
+                self.ped.catching_main(['--mmap', '-f', temp_path, r'S/Fred(\s+)Flintstone/Barney\1Rubble'])
+                stdout.flush()
+                self.assertEqual(stdout.buffer.getvalue(), 'Barney\n  Rubble caf\u00e9\n'.encode('utf-8'))
+
+    def test_mmap_crlf(self):
+        with tempfile.TemporaryDirectory('_mmap') as temp_dir:
+            temp_path = os.path.join(temp_dir, 'crlf.txt')
+            with open(temp_path, 'wb') as f:
+                f.write(b'Fred\r\n  Flintstone cafe\r\n')
+            argv = ['--mmap', '-f', temp_path, r'S/Fred([ \r\n]+)Flintstone/Barney\1Rubble']
+            args = ped.parse_args(argv)
+            self.assertFalse(ped.can_map(args, ped.compile_commands(args)))
+            self.assertEqual(self.run_args(argv), 'Barney\n  Rubble cafe\n')
+
+    def test_mmap_unicode(self):
+        with tempfile.TemporaryDirectory('_mmap') as temp_dir:
+            temp_path = os.path.join(temp_dir, 'unicode.txt')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write('caf\u00e9 na\u00efve \u212a\n\u00e9t\u00e9\u00a0k\n')
+            ascii_path = os.path.join(temp_dir, 'ascii.txt')
+            with open(ascii_path, 'w', encoding='utf-8') as f:
+                f.write('Kelvin k\ncafe\n')
+            cases = [([r'O/\w+'], 'caf\u00e9na\u00efve\u212a\u00e9t\u00e9k'),
+                     ([r'S/\bna/X/'], 'caf\u00e9 X\u00efve \u212a\n\u00e9t\u00e9\u00a0k\n'),
+                     (['-i', 'O/k'], '\u212ak'), ([r'S/\s+/_/'], 'caf\u00e9_na\u00efve_\u212a_\u00e9t\u00e9_k_'),
+                     (['-m', r'S/.$/X/'], 'caf\u00e9 na\u00efve X\n\u00e9t\u00e9\u00a0X\n'),
+                     (['O/[^ a-z\n]+'], '\u00e9\u00ef\u212a\u00e9\u00e9\u00a0'), (['-a', r'R/\W'], 'cafnavetk'),
+                     (['-a', r'S/\B/-/'], 'c-a-f\u00e9- n-a\u00efv-e -\u212a-\n-\u00e9t\u00e9-\u00a0k\n-'),
+                     ([r'R/x*'], 'caf\u00e9 na\u00efve \u212a\n\u00e9t\u00e9\u00a0k\n')]
+            for argv, expected in cases:
+                with self.subTest(argv=argv):
+                    args = ped.parse_args(['--mmap', '-f', temp_path] + argv)
+                    self.assertFalse(ped.can_map(args, ped.compile_commands(args)))
+                    self.assertEqual(self.run_args(['--mmap', '-f', temp_path] + argv), expected)
+                    args = ped.parse_args(['--mmap', '-f', ascii_path] + argv)
+                    self.assertTrue(ped.can_map(args, ped.compile_commands(args)))
+                    self.assertEqual(self.run_args(['--mmap', '-f', ascii_path] + argv),
+                                     self.run_args(['-f', ascii_path] + argv))
+            args = ped.parse_args(['--mmap', '-a', '-f', temp_path, r'O/\w+'])
+            self.assertTrue(ped.can_map(args, ped.compile_commands(args)))
+            self.assertEqual(self.run_args(['--mmap', '-a', '-f', temp_path, r'O/\w+']), 'cafnavetk')
+            self.assertEqual(self.run_args(['--mmap', '-f', temp_path, r'S/na(.)ve/<\1>/']),
+                             'caf\u00e9 <\u00ef> \u212a\n\u00e9t\u00e9\u00a0k\n')
+
+    def test_mmap_not_used(self):
+        args = ped.parse_args(['--mmap', '-f', short_path, 'S/\u00e9/e/'])
+        self.assertFalse(ped.can_map(args, ped.compile_commands(args)))
+        args = ped.parse_args(['--mmap', '-f', short_path, 's/a/b/', 'S/a/b/'])
+        self.assertFalse(ped.can_map(args, ped.compile_commands(args)))
+        args = ped.parse_args(['--mmap', 'S/a/b/'])
+        self.assertFalse(ped.can_map(args, ped.compile_commands(args)))
+        args = ped.parse_args(['--mmap', '-f', short_path, 'O/a'])
+        self.assertTrue(ped.can_map(args, ped.compile_commands(args)))
+
+
+class TestSegments(TestPed):
+
+    def test_segments(self):
+        text = 'abcdefghij'
+        segments = ped.Segments([(text, 0, 4), '', 'XY', (text, 7, 7), (text, 6, 10)])
+        self.assertEqual(len(segments), 10)
+        self.assertEqual(ped.get_string(None, segments), 'abcdXYghij')
+        with patch.object(ped.Segments, 'chunk_size', 3):
+            self.assertEqual(list(segments), ['abc', 'd', 'XY', 'ghi', 'j'])
+
+    def test_positional_output_is_not_joined(self):
+        args = ped.parse_args(['A/!', 'P/>', 'I/3/_', 'D/-2/1', 'Y/1/1/B'])
+        data = ped.execute(args, ped.compile_commands(args), 'abcdef')
+        self.assertIsInstance(data, ped.Segments)
+        writes = []
+        stdout = Mock(spec=['write', 'writelines'], writelines=lambda chunks: writes.extend(chunks))
+        ped.write_output(args, data, stdout)
+        stdout.write.assert_not_called()
+        self.assertEqual(writes, ['>', 'B', 'b', '_', 'cde', '!'])
+
+    def test_segments_into_window(self):
+        text = 'abcdefgh\nij\na\nb\nc d\ne\n'
+        for argv, out in [(['Y/3/1/z/', 'U/\\w+/'], 'ABCZEFGH\nIJ\nA\nB\nC D\nE\n'),
+                          (['A/tail\nx', 'P/head\n', 'I/5/<\n>', 'S/a\\s+b/X/'],
+                           'head\n<\n>abcdefgh\nij\nX\nc d\ne\ntail\nx'),
+                          (['I/2/q\nr', 'D/0/1', 'R/\\n'], 'bqrcdefghijabc de'),
+                          (['P/a\n', 'A/\nb', 'S/\\w+\\s+\\w+/-'], '-\n-\n- -\n\nb')]:
+            for size in [2, 5]:
+                with self.subTest(argv=argv, size=size):
+                    self.assertEqual(self.run_piped(['--window', str(size)] + argv, text), out)
+
+    def test_piece_table(self):
+        text = ''.join(chr(ord('a') + n % 26) for n in range(1000))
+        argv = [f'{op}/{n * 37 % 1100 - 50}/{n % 5}/<{n}>' for n in range(200) for op in 'IYD'][:200] + ['A/$', 'P/^']
+        args = ped.parse_args(argv)
+        commands = ped.compile_commands(args)
+        data = ped.execute(args, commands, text)
+        expected = text
+        for cmd in commands:
+            start, end = cmd.num1, cmd.num1 + (cmd.num2 if cmd.op != 'I' else 0)
+            inserted = cmd.text if cmd.op != 'D' else ''
+            expected = {'A': expected + cmd.text, 'P': cmd.text + expected}.get(
+                cmd.op, expected[:start] + inserted + expected[end:])
+        self.assertEqual(ped.get_string(args, data), expected)
+        self.assertLess(len(data.chunks), 3 * len(commands))
+        self.assertTrue(all(seg[0] is text for seg in data.chunks if not isinstance(seg, str)))
+
+
+class TestBatch(TestPed):
+
+    def test_multiple_files(self):
+        out = self.run_args(['-f', abcdef_path, '-f', abc_def_path, 's/c/C/'])
+        self.assertEqual(out, 'abCdef\nabC\ndef\n')
+        out = self.run_args(['-i', '-f', os.path.join(data_path, 's*.txt'), 'g/^of'])
+        self.assertEqual(out, 'of this thing here \nOF THIS THING HERE \n')
+
+    def test_files_from(self):
+        with tempfile.TemporaryDirectory('_batch') as temp_dir:
+            listing = os.path.join(temp_dir, 'listing')
+            with open(listing, 'w', encoding='utf-8') as f:
+                f.write(f'{short_path}\0{abcdef_path}\0')
+            out = self.run_args(['--files-from', listing, 'u/^\\w'])
+            self.assertEqual(out, 'This is a test\nOf this thing here \nAnd you might be special.\nAbcdef\n')
+            out = self.run_piped(['--files-from', '-', 'x/.'], f'{abcdef_path}\n{short_path}\n')
+            self.assertEqual(out, '')
+
+    def test_jobs_ordering(self):
+        paths = [long_path, abcdef_path, short_path, abc_def_path, short_uc_path] * 3
+        argv = [arg for path in paths for arg in ['-f', path]] + ['s/[aeiou]/_/', 'S/\n(\\w)/|\\1']
+        self.assertEqual(self.run_args(['-j', '3'] + argv), self.run_args(argv))
+        argv = [arg for path in paths[1:5] * 2 for arg in ['-f', path]] + ['s/[aeiou]/_/', 'S/\n(\\w)/|\\1']
+        self.assertEqual(self.run_args(['-j', '2'] + argv),
+                         '_bcd_f\nth_s _s _ t_st|_f th_s th_ng h_r_ |_nd y__ m_ght b_ sp_c__l.\n_bc|d_f\n'
+                         'THIS IS A TEST|OF THIS THING HERE |AND YOU MIGHT BE SPECIAL.\n' * 2)
+
+    def test_jobs_in_place(self):
+        with tempfile.TemporaryDirectory('_batch') as temp_dir:
+            backup_dir = os.path.join(temp_dir, 'backups')
+            for name in ['one.txt', 'two.txt', 'three.txt']:
+                shutil.copy2(short_path, os.path.join(temp_dir, name))
+            self.run_args(['-j', '2', '-e', '-b', backup_dir, '-f', os.path.join(temp_dir, '*.txt'), 's/[aeiou]/-'])
+            for name in ['one.txt', 'two.txt', 'three.txt']:
+                text = file_get_contents(os.path.join(temp_dir, name))
+                self.assertEqual(text, 'th-s -s - t-st\n-f th-s th-ng h-r- \n-nd y-- m-ght b- sp-c--l.\n')
+            store = ped.BackupStore(backup_dir)
+            self.assertEqual(sorted(os.path.basename(entry['path']) for entry in store.get_entries()),
+                             ['one.txt', 'three.txt', 'two.txt'])
+            self.assertEqual(len({entry['blob'] for entry in store.get_entries()}), 1)
+
+    def test_jobs_error(self):
+        with self.assertRaises(ped.PedError) as ex:
+            self.run_args(['-j', '2', '-f', short_path, '-f', '/no/such/file.txt', 's/a/b/'])
+        self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_IO_ERROR)
+        with self.assertRaises(SystemExit):
+            self.run_piped(['-j', '-2', '-f', short_path, 's/a/b/'], '', err=True)
+        self.assertEqual(ped.parse_args(['-j', '0']).jobs, 0)
+
+
+class TestChunked(TestPed):
+
+    def test_chunked_matches_sequential(self):
+        text = file_get_contents(long_path) * 20
+        with tempfile.TemporaryDirectory('_chunked') as temp_dir:
+            temp_path = os.path.join(temp_dir, 'long.txt')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(text + 'last \u00e9 line')
+            for argv in [['s/[aeiou]/_/', 'g/_'], ['-Z', 'x/^a', 'u/\\b\\w'], ['-Z', 'g/last'], ['-L', '1', 'o/\\w+'],
+                         ['-Z', 'f/line/\n/'], ['-n', '-Z', 's/^$/E/']]:
+                expected = self.run_args(['-f', temp_path] + argv)
+                with patch('ped.CHUNK_SIZE', 100):
+                    args = ped.parse_args(['-j', '2', '-f', temp_path] + argv)
+                    self.assertTrue(ped.can_split(args, ped.compile_commands(args), temp_path))
+                    self.assertEqual(self.run_args(['-j', '2', '-f', temp_path] + argv), expected)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write('one\ntwo\nthree\n\nfour five\nsix')
+            for argv, out in [(['s/[aeiou]/_/', 'g/_'], '_n_\ntw_\nthr__\nf__r f_v_\ns_x\n'),
+                              (['-Z', 'g/o'], 'one\ntwo\nfour five'),
+                              (['-n', '-Z', 's/^$/E/'], 'one\ntwo\nthree\nE\nfour five\nsix'),
+                              (['-Z', 'f/e/\n/'], 'on\n\ntwo\nthr\n\n\n\nfour fiv\n\nsix')]:
+                with self.subTest(argv=argv), patch('ped.CHUNK_SIZE', 8):
+                    self.assertEqual(self.run_args(['-E', '\n', '-j', '2', '-f', temp_path] + argv), out)
+
+    def test_not_chunked(self):
+        with patch('ped.CHUNK_SIZE', 100):
+            for argv in [['-M', '3', 's/a/b/'], ['a/x', 's/a/b/'], ['S/a/b/'], ['-e', 's/a/b']]:
+                args = ped.parse_args(['-j', '2', '-f', long_path] + argv)
+                self.assertFalse(ped.can_split(args, ped.compile_commands(args), long_path))
+
+
+class TestFusedFilters(TestPed):
+
+    def test_fused_matches_separate(self):
+        text = file_get_contents(long_path)
+        for argv in [['g/a', 'x/the', 'G/.*s.*', 'X/^P.*'], ['-i', 'x/python', 'x/(\\w)\\1', 'x/(?=w)', 'g/ '],
+                     ['x/a', 'x/e', 's/o/0', 'x/i', 'g/u', 'x/0']]:
+            args = ped.parse_args(argv)
+            expected = ped.get_string(args, ped.execute(args, ped.compile_commands(args), text))
+            self.assertEqual(self.run_piped(argv, text), expected)
+        for argv, out in [(['g/ ', 'x/the', 'G/.*s.*'], 'Python is fun\n3 ms timeout in step 4\n'),
+                          (['-i', 'x/python', 'x/(\\w)\\1', 'g/ '], '3 ms timeout in step 4\nthe end\n'),
+                          (['x/a', 'x/u', 's/o/0', 'g/^.'], 'the end\n')]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_piped(['-E', '\n'] + argv, python_text), out)
+
+    def test_single_pass(self):
+        args = ped.parse_args(['g/a', 'x/b', 'x/c', 'G/.*', 's/a/b/', 'x/d'])
+        commands = ped.compile_commands(args)
+        fused = ped.chain_line_stages(args, ['abd', 'xa', 'ac', 'ad', 'ab'], commands[:4])
+        self.assertEqual(fused.__name__, 'iter_checked_lines')
+        self.assertEqual(list(fused), ['xa', 'ad'])
+        self.assertEqual(list(ped.chain_line_stages(args, ['abd', 'xa', 'ac', 'ad', 'ab'], commands)), ['xb'])
+
+    def test_combine_excludes(self):
+        args = ped.parse_args(['x/a', 'x/b|c', 'x/(d)\\1', 'x/e', 'x/f', 'g/g'])
+        combined = ped.combine_excludes(args, ped.compile_commands(args))
+        self.assertEqual([cmd.pattern.pattern for cmd in combined],
+                         ['(?:a)|(?:b|c)', '(d)\\1', '(?:e)|(?:f)', 'g'])
+
+
+class TestLiterals(TestPed):
+    text = file_get_contents(long_path) + 'Stra\u00dfe PYTHON pyth\u00f6n python\tPython\n\nthe end'
+
+    def test_literal_matches_regex(self):
+        for argv in [['f/on/ON/'], ['-M', '5', 'f/on/ON/'], ['-L', '1', 's/on/ON/'], ['-M', '7', '-L', '2', 'f/o/0'],
+                     ['-i', 'f/python/snake/'], ['-i', '-M', '3', 's/PYTHON/py/'], ['-i', '-L', '1', 'f/P/p'],
+                     ['s/in/\\n/', 's/a/\\t\\\\/'], ['s/ is/\\g<0>!/'], ['g/python', 'x/Python'], ['G/the end'],
+                     ['X/the end', 'o/on', 'r/o'], ['-i', 'g/python', 'o/P', 'r/t'], ['u/in', 'l/IN', 't/the', 'c/is'],
+                     ['-F', 'S/.\n/!/'], ['-F', '-M', '2', 'R/,'], ['-F', 'O/an'], ['-F', 'U/ython'],
+                     ['-i', '-F', 'O/PY'], ['f/e/\\n/', 'S/\n\n/|/'], ['-Z', 'f/d/\f/'], ['f/d/\f\n/'],
+                     ['-F', 'g/.', 's/.*/[\\g<0>]/']]:
+            with self.subTest(argv=argv):
+                expected = self.run_piped(argv, self.text)
+                with patch('ped.literal_mode', return_value=None):
+                    self.assertEqual(self.run_piped(argv, self.text), expected)
+        for argv, out in [(['f/on/ON/'], 'PythON is fun\nthe pythON way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['-M', '1', 'f/on/ON/'],
+                           'PythON is fun\nthe python way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['-i', 'f/python/snake/'],
+                           'snake is fun\nthe snake way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['-i', '-L', '1', 'f/P/p'],
+                           'python is fun\nthe python way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['s/in/\\n/', 's/ is/\\g<0>!/'],
+                           'Python is! fun\nthe python way\n\n3 ms timeout \n step 4\nthe end\n')]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_piped(['-E', '\n'] + argv, python_text), out)
+
+    def test_literal_detection(self):
+        args = ped.parse_args(['s/ERROR: /x/', 's/a.b/x/', 'f/a.b/x\\ty', 's/a/\\g<0>', 'u/ab', '-i'])
+        commands = ped.compile_commands(args)
+        self.assertEqual([cmd.literal for cmd in commands], ['ERROR: ', None, 'a.b', 'a', 'ab'])
+        self.assertEqual([cmd.literal_replacement for cmd in commands], ['x', 'x', 'x\ty', None, 'AB'])
+        self.assertEqual([ped.literal_mode(args, cmd) for cmd in commands],
+                         [ped.LITERAL_FOLDED, None, ped.LITERAL_FOLDED, ped.LITERAL_FOLDED, ped.LITERAL_FOLDED])
+        self.assertTrue(ped.is_block_stage(ped.parse_args([]), commands[0]))
+
+    def test_literal_blocks(self):
+        with patch('ped.BLOCK_SIZE', 50):
+            out = self.run_piped(['f/on/ON', 'f/ON\n/_', 's/e/E/'], self.text)
+        self.assertEqual(out, self.run_piped(['s/on/ON', 's/ON\n/_', 's/e/E/'], self.text))
+
+    def test_literal_blocks_separators(self):
+        for argv, text, out in [(['s/x/Y/'], 'ab\nxb\x0c', 'ab\nYb\n'), (['s/x/Y/'], 'ab\nxb\r', 'ab\nYb\n'),
+                                (['s/x/Y/'], 'ab\nxb\u2028', 'ab\nYb\n'), (['s/x//'], 'a\rx\nb\n', 'a\n\nb\n'),
+                                (['f/x//'], 'a\rx\nb\n', 'a\n\nb\n'), (['f/x/\n/'], 'a\rx\nb\n', 'a\n\n\nb\n'),
+                                (['u/x'], 'x\x0bx\x1c\x1dx\x1ex\x85', 'X\nX\n\nX\nX\n')]:
+            for size in [3, ped.BLOCK_SIZE]:
+                with self.subTest(argv=argv, text=text, size=size), patch('ped.BLOCK_SIZE', size):
+                    self.assertEqual(self.run_piped(argv, text), out)
+
+
+class TestRegexBlocks(TestPed):
+    text = (file_get_contents(long_path) + 'Stra\u00dfe PYTHON pyth\u00f6n python\tPython\n\n'
+            + 'form\ffeed  line\x85next\r\nthe end')
+
+    def test_blocks_match_lines(self):
+        for argv in [['s/o+/0/'], ['s/^/> /', 's/$/ </'], ['s/x*/-/'], ['s/\\b(\\w)(\\w*)/\\2\\1/'], ['r/[aeiou]'],
+                     ['s/(?<![a-z])i/I/'], ['s/e(?!\\w)/E/'], ['-i', 's/^the/THE/'], ['u/\\bp\\w+'], ['c/[a-z]+$'],
+                     ['s/(?P<w>\\w+) (?P=w)/\\g<w>/'], ['s/ +/\\n/'], ['s/(in)/\\1\\f\\n/'], ['-d', 's/[a-z]./_/'],
+                     ['s/.$/!/', 's/^.?/?/'], ['-a', 's/\\W+/ /'], ['s/(a)?b(?(1)c|d)/#/'], ['t/(?s:.)']]:
+            for text in [self.text, self.text + '\x0c', self.text + '\u2028', self.text + '\r']:
+                with self.subTest(argv=argv, end=text[-1]):
+                    with patch('ped.can_span_lines', return_value=True):
+                        expected = self.run_piped(argv, text)
+                    self.assertEqual(self.run_piped(argv, text), expected)
+                    with patch('ped.BLOCK_SIZE', 50):
+                        self.assertEqual(self.run_piped(argv, text), expected)
+        for argv, out in [(['s/o+/0/'], 'Pyth0n is fun\nthe pyth0n way\n\n3 ms time0ut in step 4\nthe end\n'),
+                          (['s/^/> /', 's/$/ </'],
+                           '> Python is fun <\n> the python way <\n>  <\n> 3 ms timeout in step 4 <\n> the end <\n'),
+                          (['s/\\b(\\w)(\\w*)/\\2\\1/'],
+                           'ythonP si unf\nhet ythonp ayw\n\n3 sm imeoutt ni teps 4\nhet nde\n'),
+                          (['-i', 's/^the/THE/'], 'Python is fun\nTHE python way\n\n3 ms timeout in step 4\nTHE end\n'),
+                          (['s/ +/\\n/'],
+                           'Python\nis\nfun\nthe\npython\nway\n\n3\nms\ntimeout\nin\nstep\n4\nthe\nend\n')]:
+            with self.subTest(argv=argv), patch('ped.BLOCK_SIZE', 20):
+                self.assertEqual(self.run_piped(['-E', '\n'] + argv, python_text), out)
+
+    def test_separators_at_end(self):
+        for argv, text, out in [(['s/x+/Y/'], 'ab\nxb\x0c', 'ab\nYb\n'), (['s/x+/Y/'], 'ab\nxb\u2028', 'ab\nYb\n'),
+                                (['-i', 'r/b/'], 'ab\nxb\x0c', 'a\nx\n'), (['s/b$/B/'], 'ab\rxb\x85', 'aB\nxB\n'),
+                                (['s/^x/Y/'], 'a\x0bxb\nx\r', 'a\nYb\nY\n')]:
+            with self.subTest(argv=argv, text=text):
+                self.assertEqual(self.run_piped(argv, text), out)
+
+    def test_can_span_lines(self):
+        single = ['abc', '^a.c$', r'[^\s]?', r'\bx\w+\B', r'(?!\d)\S+', '(a|b)*?c{2}', r'(x)\1', r'[\[\]]']
+        spanning = [r'\n', r'a\s', '[^a-z]', '[\x00-\x1f]', r'\Aa', r'a\Z', r'(?<=\W)a', '(?s).', '(?s:a.)', r'\D']
+        for pattern in single + spanning:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(ped.can_span_lines(ped.re.compile(pattern)), pattern in spanning)
+        self.assertFalse(ped.can_span_lines(ped.re.compile('(?-s:.)', ped.re.DOTALL)))
+        self.assertTrue(ped.can_span_lines(ped.re.compile('.', ped.re.DOTALL)))
+
+
+class TestGuards(TestPed):
+    text = TestRegexBlocks.text + '\n'.join(f'{n} ms timeout in step {n % 7}' for n in range(0, 400, 37)) + '\n'
+
+    def test_guard_detection(self):
+        args = ped.parse_args(['s/(\\d+) ms timeout/x/', 'g/ERROR: .*timeout', 'o/\\w+ing', 'u/the', 's/\\d+/x/',
+                               'x/a|b', 'x/c|d', 'i/0/x'])
+        commands = ped.compile_commands(args)
+        self.assertEqual([cmd.guard for cmd in commands], [' ms timeout', 'ERROR: ', 'ing', 'the', '', '', '', ''])
+        self.assertEqual([cmd.guard for cmd in ped.combine_excludes(args, commands[5:7])], [''])
+        excludes = ped.compile_commands(ped.parse_args(['x/abc', 'x/abd']))
+        self.assertEqual([cmd.guard for cmd in ped.combine_excludes(args, excludes)], ['ab'])
+        self.assertEqual(ped.compile_commands(ped.parse_args(['-i', 'g/ERROR: .*timeout']))[0].guard, '')
+
+    def test_guarded_matches_unguarded(self):
+        for argv in [['s/(\\d+) ms timeout/T\\1/'], ['-M', '3', 's/(\\d+) ms/\\1ms/'], ['-L', '1', 'r/\\w+ing\\b'],
+                     ['g/\\d ms.*[0-3]$'], ['G/.* ms timeout .*'], ['x/step [1-4]', 'X/the.*'], ['o/\\d+ ms'],
+                     ['u/p\\w+on'], ['s/^(\\d+) ms/\\1/', 's/timeout$/!/'], ['s/\\w+ in\\b/\\n/']]:
+            with self.subTest(argv=argv):
+                with patch.object(ped.CachedPattern, 'required', new=property(lambda self: '')):
+                    expected = self.run_piped(argv, self.text)
+                self.assertEqual(self.run_piped(argv, self.text), expected)
+                for gap in [0, 40, 10000]:
+                    with patch('ped.BLOCK_SIZE', 200), patch('ped.GUARD_GAP', gap):
+                        self.assertEqual(self.run_piped(argv, self.text), expected)
+        for argv, out in [(['s/(\\d+) ms timeout/T\\1/'], 'Python is fun\nthe python way\n\nT3 in step 4\nthe end\n'),
+                          (['-M', '1', 's/e/E/'], 'Python is fun\nthE python way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['g/\\d ms.*[0-4]$'], '3 ms timeout in step 4\n'),
+                          (['x/step [1-4]', 'X/the.*'], 'Python is fun\n\n'),
+                          (['s/\\w+ in\\b/\\n/'], 'Python is fun\nthe python way\n\n3 ms \n step 4\nthe end\n')]:
+            for gap in [0, 10000]:
+                with self.subTest(argv=argv, gap=gap), patch('ped.BLOCK_SIZE', 20), patch('ped.GUARD_GAP', gap):
+                    self.assertEqual(self.run_piped(['-E', '\n'] + argv, python_text), out)
+
+    def test_guard_skips_lines(self):
+        regex_subn = Mock(return_value=('x', 1))
+        subn = ped.guarded_subn('ms', regex_subn)
+        self.assertEqual(subn('no match here'), ('no match here', 0))
+        self.assertEqual(regex_subn.call_count, 0)
+        self.assertEqual(subn('5 ms', count=1), ('x', 1))
+        regex_subn.assert_called_once_with('5 ms', count=1)
+        pattern = ped.re.compile('(\\d+) ms', ped.re.MULTILINE)
+        text = 'a\nb 1 ms 2 ms\nc\n3 ms\nd'
+        block_subn = Mock(side_effect=functools.partial(pattern.subn, '\\1'))
+        self.assertEqual(ped.guarded_block_subn(block_subn, ' ms', text), ('a\nb 1 2\nc\n3\nd', 3))
+        self.assertEqual([call.args[0] for call in block_subn.call_args_list], ['b 1 ms 2 ms\nc\n3 ms'])
+        with patch('ped.GUARD_GAP', 0):
+            block_subn.reset_mock()
+            self.assertEqual(ped.guarded_block_subn(block_subn, ' ms', text), ('a\nb 1 2\nc\n3\nd', 3))
+            self.assertEqual([call.args[0] for call in block_subn.call_args_list], ['b 1 ms 2 ms', '3 ms'])
+            self.assertEqual(ped.guarded_block_subn(block_subn, ' ms', '1 ms x\n2 ms y 3 ms'), ('1 x\n2 y 3', 3))
+
+
+class TestLineIndex(TestPed):
+
+    def test_line_starts(self):
+        for text in ['', 'a', 'a\n', '\n\n', 'one\n\nthree\nfour', 'one\ntwo\n\n']:
+            lines = text.splitlines(keepends=True)
+            starts = [sum(len(line) for line in lines[:n]) for n in range(len(lines) + 1)]
+            for order in [range(len(starts)), reversed(range(len(starts))), [len(starts) // 2, 0, len(starts) - 1]]:
+                index = ped.LineIndex(text)
+                with self.subTest(text=text, order=list(order)):
+                    self.assertEqual(len(index), len(lines))
+                    self.assertEqual({n: index.start(n) for n in order}, {n: starts[n] for n in order})
+
+    def test_splice(self):
+        args = ped.parse_args(['-E', '\n'])
+        commands = ped.compile_commands(ped.parse_args(['d/0/1', 'i/-1/x\ny', 'y/2/2/z', 'd/-2/1']))
+        out = ped.execute(args, commands, 'h\n1\n2\n3\n4\n5')
+        self.assertIsInstance(out, ped.IndexedLines)
+        self.assertEqual(len(out.pieces), 4)
+        self.assertEqual(''.join(out), '1\n2\nz\nx\n5\n')
+
+    def test_index_matches_lines(self):
+        text = file_get_contents(long_path) + 'the\fend'
+        for argv in [['d/0/1'], ['d/-3/1'], ['y/-1/2/last', 'i/-1/a\x0cb'],
+                     ['d/0/1', 's/e/E/', 'd/-1/1'], ['-Z', 'i/-1/x\n'], ['i/99/a', 'y/-99/1/b'], ['D/0/5', 'd/0/1'],
+                     ['y/-1/3/wrap'], ['d/5/-3']]:
+            with self.subTest(argv=argv):
+                with patch('ped.can_index_lines', return_value=False):
+                    expected = self.run_piped(argv, text)
+                self.assertEqual(self.run_piped(argv, text), expected)
+                with patch('ped.can_index_lines', return_value=False):
+                    expected = self.run_piped(argv, text.replace('\f', ' '))
+                self.assertEqual(self.run_piped(argv, text.replace('\f', ' ')), expected)
+        for argv, out in [(['d/0/1'], 'the python way\n\n3 ms timeout in step 4\nthe end\n'),
+                          (['d/-3/1'], 'Python is fun\nthe python way\n3 ms timeout in step 4\nthe end\n'),
+                          (['d/0/1', 's/e/E/'], 'thE python way\n\n3 ms timEout in stEp 4\nthE End\n'),
+                          (['i/99/a', 'y/-99/1/b'],
+                           'b\nPython is fun\nthe python way\n\n3 ms timeout in step 4\nthe end\na\n')]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_piped(['-E', '\n'] + argv, python_text + '\n'), out)
+
+    def test_inplace_index(self):
+        with tempfile.TemporaryDirectory('_index') as temp_dir:
+            temp_path = os.path.join(temp_dir, 'long.txt')
+            shutil.copy2(long_path, temp_path)
+            expected = self.run_args(['-f', long_path, 'd/0/3', 'y/1/1/one', 'i/2/two\n'])
+            self.run_args(['-e', '-b', temp_dir, '-f', temp_path, 'd/0/3', 'y/1/1/one', 'i/2/two\n'])
+            self.assertEqual(file_get_contents(temp_path), expected)
+            for argv, out in [(['d/0/3', 'y/1/1/one', 'i/2/two\n'], '3 ms timeout in step 4\none\ntwo\n\n'),
+                              (['d/-2/1', 'i/-1/x'], 'Python is fun\nthe python way\n\nx\nthe end\n')]:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(python_text + '\n')
+                self.run_args(['-E', '\n', '-e', '-b', temp_dir, '-f', temp_path] + argv)
+                self.assertEqual(file_get_contents(temp_path), out)
+
+
+class TestDocument(TestPed):
+
+    def test_cached_forms(self):
+        args = ped.parse_args([])
+        lines = ['a', 'b']
+        document = ped.Document(lines)
+        text = ped.get_string(args, document)
+        self.assertEqual(text, f'a{os.linesep}b{os.linesep}')
+        self.assertIs(ped.get_string(args, document), text)
+        self.assertIs(document.update(text), document)
+        self.assertIs(ped.get_lines(args, document), lines)
+        self.assertIsNot(document.update(lines), document)
+
+    def test_unchanged_text_keeps_lines(self):
+        args = ped.parse_args(['-E', '\n', 's/a/A/', 'S/zzz/y/', 'g/A', 'U/zzz', 'x/y', 'S/A/a/'])
+        with patch('ped.get_lines', wraps=ped.get_lines) as get_lines:
+            out = ped.execute(args, ped.compile_commands(args), 'abc\nbcd\nxyz\nab\n')
+        self.assertEqual(out, 'abc\nab\n')
+        self.assertEqual(sum(isinstance(call.args[1], str) for call in get_lines.call_args_list), 1)
+
+    def test_normalized_without_eof(self):
+        text = 'a\nb\nc\n\n'
+        self.assertEqual(self.run_piped(['-E', '\n', '-n', '-Z', 'd/-2/1'], text), 'a\nc')
+        self.assertEqual(self.run_piped(['-E', '\n', '-n', '-Z', 'd/-3/1'], text), 'b\nc')
+        self.assertEqual(self.run_piped(['-E', '\n', '-n', 'd/-2/1'], text), 'a\nb\n\n')
+        self.assertEqual(self.run_piped(['-E', '\n', '-n', '-Z', 'd/-2/1', 'S/\n/|/'], text), 'a|c')
+
+
+class TestBenchmarks(TestPed):
+
+    def test_corpora_are_deterministic(self):
+        from benchmarks import bench
+        for name in bench.CORPORA:
+            with self.subTest(corpus=name):
+                text = bench.generate(name, 4096)
+                self.assertEqual(bench.generate(name, 4096), text)
+                self.assertGreaterEqual(len(text.encode('utf-8')), 4096 - 200)
+        self.assertIn('\r\n', bench.generate('crlf', 1024))
+        self.assertEqual(bench.generate('json', 4096).count('\n'), 0)
+
+    def test_report(self):
+        from benchmarks import bench
+        with tempfile.TemporaryDirectory('_bench') as temp_dir:
+            report_path = os.path.join(temp_dir, 'report.json')
+            bench.main(['--sizes', '8K', '--repeat', '1', '--corpus', '^short$', '--case', '^(s|D)$',
+                        '--corpus-dir', temp_dir, '-o', report_path])
+            with open(report_path, encoding='utf-8') as f:
+                report = json.load(f)
+        self.assertEqual([(r['corpus'], r['case']) for r in report['results']], [('short', 's'), ('short', 'D')])
+        for result in report['results']:
+            self.assertEqual(result['size'], 8192)
+            self.assertGreater(result['wall'], 0)
+            self.assertGreater(result['mb_per_s'], 0)
+
+    def test_startup_imports(self):
+        from benchmarks import startup
+        imported = [name for name, _, _ in startup.get_imports(['s/fox/cat/'])]
+        self.assertIn('argparse', imported)
+        self.assertEqual([name for name in startup.DEFERRED_MODULES if name in imported], [])
+        imported = [name for name, _, _ in startup.get_imports(['--profile=json', 's/fox/cat/'])]
+        self.assertIn('json', imported)
+
+    def test_script(self):
+        from benchmarks import startup
+        result = subprocess.run([sys.executable, startup.PED_PATH, 's/fox/cat/'], input='a fox\n',
+                                capture_output=True, text=True)
+        self.assertEqual((result.returncode, result.stdout), (0, 'a cat\n'))
+        result = subprocess.run([sys.executable, startup.PED_PATH, 's/(/'], input='', capture_output=True,
+                                text=True)
+        self.assertEqual(result.returncode, ped.PedErrorTypes.PED_RE_ERROR)
+        self.assertIn('regular expression invalid', result.stderr)
+
+
+class TestProfile(TestPed):
+
+    def test_table(self):
+        out, err = self.run_piped(['--profile', 's/a/A/', 'g/A', 'S/A\\nA/-/'], 'ab\nab\ncd\n', err=True)
+        self.assertEqual(out, 'Ab\nAb\n')
+        lines = err.splitlines()
+        self.assertEqual(lines[0].split()[:3], ['command', 'wall', 'ms'])
+        self.assertEqual([line.split()[0] for line in lines[1:-1]], ['(read)', 's/a/A/', 'g/A', 'S/A\\nA/-/',
+                                                                      '(write)', 'total'])
+        self.assertRegex(lines[-1], r'^pattern cache: \d+ hits, \d+ misses, \d+ of 256 entries$')
+
+    def test_json(self):
+        for argv in [['s/o/0/', 'x/x', 'S/e\\nt/-/', 'I/0/>'], ['-W', '3', 's/o/0/', 'x/x', 'S/e\\nt/-/', 'I/0/>']]:
+            with self.subTest(argv=argv):
+                out, err = self.run_piped(['--profile=json'] + argv, 'one\ntwo\nxxx\n', err=True)
+                self.assertEqual(out, '>0n-w0\n')
+                stages = {stage['command']: stage for stage in json.loads(err)['stages']}
+                self.assertEqual(list(stages), ['(read)'] + argv[-4:] + ['(write)'])
+                self.assertEqual([stages[item]['matches'] for item in argv[-4:-1]], [2, 1, 1])
+                self.assertEqual((stages['x/x']['lines_in'], stages['x/x']['lines_out']), (3, 2))
+                self.assertEqual(stages['x/x']['bytes_out'], 8)
+                self.assertTrue(all(stage['wall'] >= 0 for stage in stages.values()))
+
+    def test_conversions(self):
+        args = ped.parse_args(['--profile', 's/a/b/', 'S/b/c/', 'u/c', 'U/C'])
+        ped.execute(args, ped.compile_commands(args), 'a\nb\n')
+        self.assertEqual([row['conversions'] for row in args.profiler.get_rows()], [1, 1, 1, 1])
+
+
+class TestPatternCache(TestPed):
+
+    def test_lru(self):
+        cache = ped.PatternCache(2)
+        a = cache.get('a+', 0)
+        self.assertIs(cache.get('a+', 0), a)
+        self.assertIsNot(cache.get('a+', 0, fixed=True), a)
+        self.assertEqual(cache.get('a+', 0, fixed=True).pattern.pattern, r'a\+')
+        self.assertIs(cache.get('a+', 0), a)
+        cache.get('b', 0)
+        self.assertEqual(list(cache.entries), [('a+', 0, False), ('b', 0, False)])
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertIs(cache.analyze(a.pattern), a)
+        cache.resize(1)
+        self.assertEqual(list(cache.entries), [('a+', 0, False)])
+        self.assertEqual(list(cache.by_pattern), [a.pattern])
+        cache.analyze(ped.re.compile('c'))
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+
+    def test_size_option(self):
+        with self.assertRaises(SystemExit):
+            self.run_piped(['--pattern-cache', '-1', 's/a/b/'], 'a\n', err=True)
+        self.assertEqual(ped.parse_args(['--pattern-cache', '0']).pattern_cache, 0)
+
+    def test_analysis(self):
+        cache = ped.PatternCache()
+        for text, flags, fixed, literal, prefix, required, spans in [
+                ('foo', 0, False, 'foo', 'foo', 'foo', False), ('a.b', 0, True, 'a.b', 'a.b', 'a.b', False),
+                ('foo', ped.re.IGNORECASE, False, 'foo', '', '', False),
+                ('ERROR: \\d+', 0, False, None, 'ERROR: ', 'ERROR: ', False),
+                ('(ab)(c|d)e', 0, False, None, 'ab', 'ab', False), ('^x\\n', 0, False, None, '', 'x\n', True),
+                ('(?i:ab)c', 0, False, None, '', 'c', False), ('.', ped.re.DOTALL, False, None, '', '', True),
+                ('\\d+ (?:mb|kb) free', 0, False, None, '', ' free', False),
+                ('x(?:abcd)+y?', 0, False, None, 'x', 'abcd', False)]:
+            with self.subTest(text=text, flags=flags, fixed=fixed):
+                entry = cache.get(text, flags, fixed)
+                self.assertEqual((entry.literal, entry.prefix, entry.required, entry.spans_lines),
+                                 (literal, prefix, required, spans))
+        self.assertEqual(ped.get_literal_prefix(ped.re.compile('abc+')), 'ab')
+        self.assertEqual(ped.get_required_literal(ped.re.compile('a?bcd+')), 'bc')
+
+    def test_shared_by_scripts(self):
+        ped.compile(['s/shared cache/x/', 'u/other'])
+        hits = ped.PATTERNS.hits
+        script = ped.compile(['s/shared cache/x/', 'u/other'])
+        self.assertEqual(ped.PATTERNS.hits - hits, 2)
+        self.assertEqual(script.apply('a shared cache\nother\n'), 'a x\nOTHER\n')
+        out, err = self.run_piped(['--profile=json', '--pattern-cache', '10', 's/shared cache/x/'], 'shared cache\n',
+                                  err=True)
+        self.assertEqual(out, 'x\n')
+        self.assertEqual(json.loads(err)['pattern_cache']['size'], 10)
+        ped.compile(['s/a/b/'])
+        ped.parse_args(['s/a/b/'])
+        self.assertEqual(ped.PATTERNS.size, 10)
+        ped.PATTERNS.resize(256)
+
+    def test_profile_counts_commands_only(self):
+        with patch('ped.PATTERNS', ped.PatternCache()):
+            _, err = self.run_piped(['--profile=json', 's/counted \\d+/x/', 'g/x'], 'counted 1\n', err=True)
+        cache = json.loads(err)['pattern_cache']
+        self.assertEqual((cache['hits'], cache['misses']), (0, 2))
+
+
+class TestInPlace(TestPed):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp('_in_place')
+        self.backup_dir = os.path.join(self.temp_dir, 'backups')
+        self.path = os.path.join(self.temp_dir, 'file.txt')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('one\ntwo\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def edit(self, *argv):
+        return self.run_args(['-e', '-b', self.backup_dir, '-f', self.path] + list(argv))
+
+    def get_backups(self):
+        store = ped.BackupStore(self.backup_dir)
+        return [store.get_blob_path(entry['blob']) for entry in store.get_entries()]
+
+    def test_replaced_with_hard_link_backup(self):
+        os.chmod(self.path, 0o640)
+        inode = os.stat(self.path).st_ino
+        self.edit('--backup-compression', 'none', 's/o/0/')
+        backup, = self.get_backups()
+        self.assertEqual(os.stat(backup).st_ino, inode)
+        self.assertEqual(file_get_contents(backup), 'one\ntwo\n')
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        for argv in [['g/0', 'S/\\n//'], ['--mmap', 'S/w/W/']]:
+            with self.subTest(argv=argv):
+                self.edit(*argv)
+        self.assertEqual(file_get_contents(self.path), '0netW0')
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['backups', 'file.txt'])
+
+    def test_failed_write_leaves_original(self):
+        def failing_write(args, data, stream):
+            stream.write('partial')
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        with patch('ped.write_output', failing_write):
+            with self.assertRaises(ped.PedError):
+                self.edit('s/o/0/')
+        self.assertEqual(file_get_contents(self.path), 'one\ntwo\n')
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['backups', 'file.txt'])
+        self.assertEqual(ped.BackupStore(self.backup_dir).get_entries(), [])
+
+    def test_copy_backup(self):
+        inode = os.stat(self.path).st_ino
+        with patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            self.edit('--backup-compression', 'none', 'u/t')
+        self.assertEqual(file_get_contents(self.path), 'one\nTwo\n')
+        backup, = self.get_backups()
+        self.assertNotEqual(os.stat(backup).st_ino, inode)
+        self.assertEqual(file_get_contents(backup), 'one\ntwo\n')
+
+    def test_unchanged(self):
+        before = os.stat(self.path)
+        with patch('sys.stderr', new=StringIO()) as stderr:
+            self.edit('--status', 'x/three', 's/four/4/')
+        self.assertEqual(stderr.getvalue(), f'unchanged {self.path}\n')
+        after = os.stat(self.path)
+        self.assertEqual((after.st_ino, after.st_mtime_ns), (before.st_ino, before.st_mtime_ns))
+        self.assertFalse(os.path.exists(self.backup_dir) and os.listdir(self.backup_dir))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['file.txt'])
+        with patch('sys.stderr', new=StringIO()) as stderr:
+            self.edit('--status', 's/\\d/x/')
+        self.assertEqual(stderr.getvalue(), f'unchanged {self.path}\n')
+        self.assertEqual(os.stat(self.path).st_ino, before.st_ino)
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), ['backups', 'file.txt'])
+
+    def test_changed(self):
+        lines = [f'line {n}' for n in range(30000)]
+        for text, argv, expected in [('a\r\nb\r\n', ['x/zzz'], 'a\nb\n'), ('a\nb\nc\n', ['d/1/1'], 'a\nc\n'),
+                                     ('a\nb', ['g/.'], 'a\nb\n'), ('a\nb\n', ['-Z', 'g/.'], 'a\nb'),
+                                     ('\n'.join(lines) + '\n', ['s/^line 29999$/last/'],
+                                      '\n'.join(lines[:-1]) + '\nlast\n')]:
+            with self.subTest(text=text[:20], argv=argv):
+                with open(self.path, 'w', encoding='utf-8', newline='') as f:
+                    f.write(text)
+                with patch('sys.stderr', new=StringIO()) as stderr:
+                    self.edit('--status', '-E', '\n', *argv)
+                self.assertEqual(stderr.getvalue(), f'changed {self.path}\n')
+                with open(self.path, encoding='utf-8', newline='') as f:
+                    self.assertEqual(f.read(), expected)
+
+    def test_symlink(self):
+        link = os.path.join(self.temp_dir, 'link.txt')
+        os.symlink(self.path, link)
+        self.run_args(['-e', '-b', self.backup_dir, '-f', link, 'a/three'])
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(file_get_contents(self.path), 'one\ntwo\nthree\n')
+
+
+class TestPrescan(TestPed):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp('_prescan')
+        self.path = os.path.join(self.temp_dir, 'file.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def edit(self, text, argv):
+        with open(self.path, 'wb') as f:
+            f.write(text)
+        return self.run_args(['-E', '\n', '-f', self.path] + argv)
+
+    def test_skips_commands(self):
+        with patch('ped.run_segments') as run_segments:
+            for text, argv in [(b'one\ntwo\n', ['s/three/3/', 'U/fo+ur', 'x/five']), (b'', ['s/a/b/']),
+                               (b'no eof', ['-Z', 'r/x']), ('\u00e9t\u00e9\n'.encode('utf-8'), ['f/.*/x/'])]:
+                with self.subTest(argv=argv):
+                    self.assertEqual(self.edit(text, argv), text.decode('utf-8'))
+            self.assertEqual(run_segments.call_count, 0)
+            self.assertTrue(ped.compile('s/a/b/', line_ending='\n').apply('xyz\n') == 'xyz\n')
+            self.assertEqual(run_segments.call_count, 0)
+
+    def test_runs_commands(self):
+        for text, argv, out in [(b'one\r\ntwo', ['s/three/3/'], 'one\ntwo\n'), (b'one\n', ['-Z', 's/x/y/'], 'one'),
+                                (b'one\ntwo\n', ['s/two/2/', 's/three/3/'], 'one\n2\n'),
+                                (b'one\n', ['s/o/0/', 'g/1'], ''), (b'one\n', ['-i', 's/ONE/1/'], '1\n'),
+                                (b'one\n', ['s/\\w+/x/'], 'x\n'), (b'one\x0ctwo\n', ['s/three/3/'], 'one\ntwo\n')]:
+            with self.subTest(argv=argv, text=text):
+                self.assertEqual(self.edit(text, argv), out)
+        self.assertEqual(ped.compile('s/a/b/', line_ending='\n').apply('xyz'), 'xyz\n')
+
+    def test_template_error(self):
+        for argv in [['f/a/\\1/'], ['-e', '-b', os.path.join(self.temp_dir, 'backups'), 's/a+/\\2/']]:
+            with self.subTest(argv=argv):
+                with self.assertRaises(ped.PedError) as ex:
+                    self.edit(b'xyz\n', argv)
+                self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_RE_ERROR)
+        self.assertEqual(file_get_contents(self.path), 'xyz\n')
+
+    def test_invalid_utf8(self):
+        with self.assertRaises(ped.PedError):
+            self.edit(b'one\xff\n', ['s/three/3/'])
+
+
+class TestBackupStore(TestPed):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp('_store')
+        self.backup_dir = os.path.join(self.temp_dir, 'backups')
+        self.path = os.path.join(self.temp_dir, 'file.txt')
+        self.write('one\ntwo\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, text, path=None):
+        with open(path or self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def edit(self, *argv):
+        return self.run_args(['-e', '-b', self.backup_dir, '-f', self.path] + list(argv))
+
+    def read(self, store, entry):
+        return b''.join(store.iter_blob(entry)).decode('utf-8')
+
+    def test_compression_and_dedup(self):
+        other = os.path.join(self.temp_dir, 'other.txt')
+        self.write('one\ntwo\n' * 1000, other)
+        for compression in ['zlib', 'lzma', 'none']:
+            with self.subTest(compression=compression):
+                store = ped.BackupStore(os.path.join(self.temp_dir, compression), compression)
+                first, second = store.add(other), store.add(other)
+                self.assertEqual(first['blob'], second['blob'])
+                self.assertTrue(first['blob'].endswith(ped.BACKUP_SUFFIXES[compression]))
+                self.assertEqual(self.read(store, first), 'one\ntwo\n' * 1000)
+                if compression != 'none':
+                    self.assertLess(os.path.getsize(store.get_blob_path(first['blob'])), 1000)
+        store = ped.BackupStore(os.path.join(self.temp_dir, 'zlib'), 'lzma')
+        self.assertTrue(store.add(other)['blob'].endswith('.z'))
+
+    def test_restore(self):
+        self.edit('s/one/1/')
+        self.edit('s/two/2/')
+        self.assertEqual(file_get_contents(self.path), '1\n2\n')
+        entries = ped.BackupStore(self.backup_dir).get_entries()
+        self.assertEqual([entry['size'] for entry in entries], [8, 6])
+        listing = self.run_args(['-b', self.backup_dir, '--list-backups', self.path]).splitlines()
+        self.assertEqual([line.split()[1:] for line in listing], [['8', entries[0]['blob']], ['6', entries[1]['blob']]])
+        self.run_args(['-b', self.backup_dir, '--restore', self.path])
+        self.assertEqual(file_get_contents(self.path), '1\ntwo\n')
+        before = datetime.datetime.fromtimestamp(entries[1]['time'] - 0.0001).isoformat()
+        self.run_args(['-b', self.backup_dir, '--restore', self.path, '--backup-time', before])
+        self.assertEqual(file_get_contents(self.path), 'one\ntwo\n')
+        os.unlink(self.path)
+        self.run_args(['-b', self.backup_dir, '--restore', self.path])
+        self.assertEqual(file_get_contents(self.path), '1\ntwo\n')
+        with self.assertRaises(ped.PedError) as context:
+            self.run_args(['-b', self.backup_dir, '--restore', os.path.join(self.temp_dir, 'none.txt')])
+        self.assertEqual(context.exception.type, ped.PedErrorTypes.PED_IO_ERROR)
+
+    def test_restore_through_symlink(self):
+        link = os.path.join(self.temp_dir, 'link.txt')
+        os.symlink(self.path, link)
+        self.run_args(['-e', '-b', self.backup_dir, '-f', link, 's/one/1/'])
+        self.assertEqual(file_get_contents(self.path), '1\ntwo\n')
+        self.assertEqual(len(self.run_args(['-b', self.backup_dir, '--list-backups', link]).splitlines()), 1)
+        self.assertEqual(len(self.run_args(['-b', self.backup_dir, '--list-backups', self.path]).splitlines()), 1)
+        self.run_args(['-b', self.backup_dir, '--restore', link])
+        self.assertEqual(file_get_contents(self.path), 'one\ntwo\n')
+        self.assertTrue(os.path.islink(link))
+
+    def test_retention(self):
+        for n in range(4):
+            self.edit(f'a/{n}')
+        store = ped.BackupStore(self.backup_dir)
+        self.assertEqual(len(store.get_entries()), 4)
+        self.edit('--backup-keep', '2', 'a/4')
+        entries = store.get_entries()
+        self.assertEqual([self.read(store, entry).count('\n') for entry in entries], [5, 6])
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(self.backup_dir, 'objects'))), 2)
+        sizes = [os.path.getsize(store.get_blob_path(entry['blob'])) for entry in entries]
+        self.assertEqual(store.prune(max_size=sizes[1]), 1)
+        self.assertEqual(store.get_entries(), entries[1:])
+        self.assertEqual(store.prune(max_age=3600), 0)
+        self.assertEqual(store.prune(max_age=0), 1)
+        self.assertEqual(store.get_entries(), [])
+
+
+class TestApi(TestPed):
+
+    def test_apply_matches_cli(self):
+        text = 'one Two\nthree\r\nfour two\n'
+        for argv, commands, options, out in [
+                ([], ['s/two/2/'], {}, 'one Two\nthree\nfour 2\n'),
+                (['-i'], ['S/two\\nthree/-/'], {'ignore_case': True}, 'one -\r\nfour two\n'),
+                (['-Z', '-E', '|'], ['g/o', 'I/0/>'], {'no_eof': True, 'line_ending': '|'}, '>one Two|four two'),
+                (['-n', '-M', '1'], ['u/o', 'd/0/1'], {'normalize': True, 'max_substitutions': 1}, 'three\nfour two\n'),
+                (['-W', '2'], ['S/e\\n/E/', 'x/four'], {'window': 2}, 'one Two\nthree\n')]:
+            with self.subTest(argv=argv, commands=commands):
+                script = ped.compile(commands, **options)
+                self.assertEqual(self.run_piped(argv + commands, text), out)
+                self.assertEqual(script.apply(text), out)
+                self.assertEqual(script.apply(text), out)
+
+    def test_apply_lines(self):
+        script = ped.compile(['s/a/b/', 'S/b\\nc/-/', 'a/end'])
+        lines = script.apply_lines(iter(['a', 'c', 'x']))
+        self.assertEqual(list(lines), ['-', 'x', 'end'])
+        self.assertEqual(list(ped.compile('x/a').apply_lines(['a', 'b'])), ['b'])
+        self.assertEqual(list(ped.compile([], normalize=True).apply_lines(['a\rb', 'c'])), ['a', 'b', 'c'])
+
+    def test_apply_file(self):
+        with tempfile.TemporaryDirectory('_api') as temp_dir:
+            path = os.path.join(temp_dir, 'file.txt')
+            backup_dir = os.path.join(temp_dir, 'backups')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write('one\ntwo\n')
+            script = ped.compile('s/o/0/', line_ending='\n', backup_path=backup_dir)
+            self.assertEqual(script.apply_file(path), '0ne\ntw0\n')
+            self.assertEqual(file_get_contents(path), 'one\ntwo\n')
+            self.assertTrue(script.apply_file(path, inplace=True))
+            self.assertEqual(file_get_contents(path), '0ne\ntw0\n')
+            self.assertFalse(script.apply_file(path, inplace=True))
+            self.assertEqual(len(ped.BackupStore(backup_dir).get_entries()), 1)
+            with self.assertRaises(ped.PedError) as context:
+                script.apply_file(os.path.join(temp_dir, 'missing.txt'))
+            self.assertEqual(context.exception.type, ped.PedErrorTypes.PED_IO_ERROR)
+
+    def test_compile_errors(self):
+        with self.assertRaises(TypeError):
+            ped.compile('s/a/b/', no_such_option=True)
+        for commands, options, error_type in [('s/(/b/', {}, ped.PedErrorTypes.PED_RE_ERROR),
+                                              ('?/a/', {}, ped.PedErrorTypes.PED_UNKNOWN_COMMAND_ERROR),
+                                              ('S/a/b/', {'window': 1}, ped.PedErrorTypes.PED_OTHER_ERROR),
+                                              ('s/a/b/', {'profile': 'xml'}, ped.PedErrorTypes.PED_OTHER_ERROR)]:
+            with self.subTest(commands=commands, options=options):
+                with self.assertRaises(ped.PedError) as context:
+                    ped.compile(commands, **options)
+                self.assertEqual(context.exception.type, error_type)
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'needs unix domain sockets')
+class TestServer(TestPed):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.mkdtemp('_serve')
+        self.socket_path = os.path.join(self.temp_dir, 'ped.sock')
+        self.ped_path = os.path.join(tests_path, 'ped.py')
+        self.server = subprocess.Popen([sys.executable, self.ped_path, '--serve', self.socket_path],
+                                       stderr=subprocess.PIPE)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.socket_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        self.server.terminate()
+        self.server.communicate(timeout=10)
+        self.assertFalse(os.path.exists(self.socket_path))
+        shutil.rmtree(self.temp_dir)
+
+    def run_client(self, argv, text='', cwd=None):
+        return subprocess.run([sys.executable, self.ped_path, '--connect', self.socket_path] + argv, input=text,
+                              capture_output=True, text=True, cwd=cwd)
+
+    def test_forwarding(self):
+        result = self.run_client(['s/o/0/', 'S/\\n/|/'], 'one\ntwo\n' * 20000)
+        self.assertEqual((result.returncode, result.stdout, result.stderr), (0, '0ne|tw0|' * 20000, ''))
+        result = self.run_client(['-f', 'abcdef.txt', 'u/b'], cwd=data_path)
+        self.assertEqual((result.returncode, result.stdout), (0, 'aBcdef\n'))
+
+    def test_errors(self):
+        result = self.run_client(['s/(/x/'], 'x\n')
+        self.assertEqual(result.returncode, ped.PedErrorTypes.PED_RE_ERROR)
+        self.assertIn('regular expression invalid', result.stderr)
+        result = self.run_client(['-f', 'missing.txt', 's/a/b/'], cwd=self.temp_dir)
+        self.assertEqual(result.returncode, ped.PedErrorTypes.PED_IO_ERROR)
+        self.assertIn('missing.txt', result.stderr)
+        self.assertEqual(self.run_client(['--no-such-option']).returncode, 2)
+        result = subprocess.run([sys.executable, self.ped_path, '--serve', self.socket_path], capture_output=True,
+                                text=True)
+        self.assertEqual(result.returncode, ped.PedErrorTypes.PED_IO_ERROR)
+        self.assertEqual(self.run_client(['u/a'], 'a\n').stdout, 'A\n')
+        result = subprocess.run([sys.executable, self.ped_path, '--serve', self.socket_path, '--connect',
+                                 self.socket_path], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('not allowed with argument', result.stderr)
+
+    def test_backups(self):
+        with open(os.path.join(self.temp_dir, 'a.txt'), 'w') as f:
+            f.write('one\ntwo\n')
+        self.assertEqual(self.run_client(['-e', '-b', 'backups', '-f', 'a.txt', 's/one/1/'], cwd=self.temp_dir)
+                         .returncode, 0)
+        result = self.run_client(['-b', 'backups', '--list-backups', 'a.txt'], cwd=self.temp_dir)
+        self.assertEqual((result.returncode, [line.split()[1] for line in result.stdout.splitlines()]), (0, ['8']))
+        self.assertEqual(self.run_client(['-b', 'backups', '--restore', 'a.txt'], cwd=self.temp_dir).returncode, 0)
+        self.assertEqual(file_get_contents(os.path.join(self.temp_dir, 'a.txt')), 'one\ntwo\n')
+        result = self.run_client(['-b', 'backups', '--restore', 'none.txt'], cwd=self.temp_dir)
+        self.assertEqual(result.returncode, ped.PedErrorTypes.PED_IO_ERROR)
+        self.assertIn('no backup of "none.txt"', result.stderr)
+
+    def test_bad_request(self):
+        for request in [b'{"argv": ["u/a"], "cwd": null}\n', b'[]\n', b'not json\n']:
+            with self.subTest(request=request), socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(self.socket_path)
+                client.sendall(request)
+                client.shutdown(socket.SHUT_WR)
+                reply = b''
+                while data := client.recv(4096):
+                    reply += data
+                self.assertEqual(reply[:1], b'e')
+                self.assertTrue(reply.endswith(b'x\x00\x00\x00\x01' + str(int(ped.PedErrorTypes.PED_OTHER_ERROR))
+                                               .encode('ascii')))
+        self.assertEqual(self.run_client(['u/a'], 'a\n').stdout, 'A\n')
+
+    def test_terminate_during_request(self):
+        client = subprocess.Popen([sys.executable, self.ped_path, '--connect', self.socket_path, 's/a/b/'],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        client.stdin.write(b'a\n')
+        client.stdin.flush()
+        time.sleep(0.2)
+        self.server.terminate()
+        self.assertEqual(self.server.wait(timeout=10), 0)
+        _, err = client.communicate(timeout=10)
+        self.assertEqual(client.returncode, ped.PedErrorTypes.PED_IO_ERROR)
+        self.assertIn(b'closed the connection', err)
+
+
+class TestCompile(TestPed):
+
+    def test_compile_commands(self):
+        args = ped.argparse.Namespace(commands=['s/a+/b/', 'f/./!', 'd/1/2', 'y/0/1/xx'], fixed=False, insensitive=0,
+                                      multiline=0, ascii=0, dotall=0)
+        sub, fixed, delete, replace = ped.compile_commands(args)
+        self.assertEqual(sub.pattern.pattern, 'a+')
+        self.assertEqual(sub.replacement, 'b')
+        self.assertEqual(fixed.pattern.pattern, r'\.')
+        self.assertEqual((delete.num1, delete.num2), (1, 2))
+        self.assertEqual((replace.num1, replace.num2, replace.text), (0, 1, 'xx'))
+        with self.assertRaises(AttributeError):
+            sub.op = 'S'
+
+    def test_fail_fast(self):
+        """a bad regex in a later command is reported before the input is read"""
+        with self.assertRaises(ped.PedError) as ex:
+            self.run_args(['-f', '/no/such/file.txt', 's/a/b/', 'g/x', 's/(/'])
+        self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_RE_ERROR)
+        with self.assertRaises(ped.PedError) as ex:
+            self.run_args(['-f', '/no/such/file.txt', 's/a/b/', '🌀/?/'])
+        self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_UNKNOWN_COMMAND_ERROR)
+
+    def test_file_scope_after_lines(self):
+        out = self.run_piped(['s/a/A/', 'O/A.'], 'abc\nxay\n')
+        self.assertEqual(out, 'AbAy')
+        out = self.run_piped(['g/a', 'U/a.'], 'abc\nxay\nzzz\n')
+        self.assertEqual(out, 'ABc\nxAY\n')
+
+
+class LineFeed:
+    """stdin stand-in that can only be iterated and records how much output existed as each line was read"""
+    def __init__(self, text, stdout):
+        self.lines = text.splitlines(keepends=True)
+        self.stdout = stdout
+        self.seen = []
+
+    def read(self):
+        raise AssertionError('input should not be read in one piece')
+
+    def readlines(self, hint):
+        lines = []
+        for line in self:
+            lines.append(line)
+            if sum(len(line) for line in lines) >= hint:
+                break
+        return lines
+
+    def __iter__(self):
+        while self.lines:
+            self.seen.append(self.stdout.getvalue())
+            yield self.lines.pop(0)
+
+
+class TestStreaming(TestPed):
+
+    def run_streamed(self, args: list[str], str_input: str):
+        with patch('sys.stdout', new=StringIO()) as stdout:
+            feed = LineFeed(str_input, stdout)
+            with patch('sys.stdin', new=feed):
+                self.ped.catching_main(args)
+            return stdout.getvalue(), feed.seen
+
+    def test_streamed(self):
+        out, seen = self.run_streamed(['g/[0-9]', 's/(\\d+)/<\\1>/', 'u/[a-z]+', 'a/end'], 'a1\nb\nc22\nd3')
+        self.assertEqual(out, 'A<1>\nC<22>\nD<3>\nend\n')
+        self.assertEqual(seen[-1], 'A<1>\nC<22>\n')
+
+    def test_streamed_max_sub(self):
+        out, _ = self.run_streamed(['-M', '3', '-L', '2', 's/[aeiou]/-'], 'aaa\neee\niii\n')
+        self.assertEqual(out, '--a\n-ee\niii\n')
+        out, _ = self.run_streamed(['-Z', 's/b/\n/', 'o/.+'], 'abc\nbcd')
+        self.assertEqual(out, 'a\nc\ncd')
+
+    def test_streamed_no_eof(self):
+        cases = [(['-Z', 's/a+/\n/'], 'ba', 'b'), (['-n', '-Z', 's/a/b/'], 'a\nb\n\n', 'b\nb'),
+                 (['-Z', 's/b/\n\n/'], 'a\nb\n\n', 'a\n\n\n'), (['-n', '-Z', 's/^$/E/'], 'a\nb\n\n', 'a\nb'),
+                 (['-Z', 's/a/\n/', 's/^$/E/'], 'a', 'E'), (['-Z', 'a/x\n'], 'a\n', 'a\nx'),
+                 (['-n', '-Z', 'S/\n/|/'], 'a\nb\n\n', 'a|b|'), (['-Z', 's/a/\n/', 's/c/\n/'], 'a\nc', '\n\n'),
+                 (['-n', '-Z', 'g/^'], 'a\n\n\n', 'a\n'), (['-Z', 'f/b/\n/', 'S/\n/|/'], 'ab\nb', 'a||')]
+        for argv, text, expected in cases:
+            argv = ['-E', '\n'] + argv
+            with self.subTest(argv=argv, text=text):
+                self.assertEqual(self.run_piped(argv, text), expected)
+                args = ped.parse_args(argv)
+                data = ped.normalize_input(args, [], text)
+                self.assertEqual(ped.get_string(args, ped.execute(args, ped.compile_commands(args), data)), expected)
+
+    mixed_commands = [['p/top', 'i/2/two', 'y/4/2/four\nfive', 'd/1/3'], ['i/100/x', 'y/50/1/y', 'd/40/4'],
+                      ['g/e', 'S/e\\s+\\w/E', 's/E/e/'], ['d/-2/1', 'i/-1/x', 'y/-3/1/z', 'u/x|z'],
+                      ['-d', 'x/^$', 'O/P.*?\\.', 'o/\\w+'], ['A/tail', 'g/a', 'P/head\n', 'l/.']]
+
+    def test_plan(self):
+        args = ped.parse_args(['g/ERROR/', 's/x/y/', 'S/a\\s+b/c/', 'i/1/x', 'i/-1/y', 'D/0/1', 'a/z'])
+        segments = ped.plan(args, ped.compile_commands(args))
+        self.assertEqual([(streamed, ''.join(cmd.op for cmd in cmds)) for streamed, cmds in segments],
+                         [(True, 'gs'), (False, 'S'), (True, 'i'), (False, 'iD'), (True, 'a')])
+
+    def test_stream_before_barrier(self):
+        out, _ = self.run_streamed(['g/ERROR/', 's/x/y/', 'S/a\\s+b/c/'], 'ERROR x a\nok a\nb ERROR\n')
+        self.assertEqual(out, 'ERROR y c ERROR\n')
+
+    def test_stream_matches_buffered(self):
+        commands = [['s/[aeiou]/-'], ['g/th', 'l/TH'], ['x/^$', 'r/\\s'], ['o/x*'], ['f/./\n', 'c/\\w+'],
+                    ['-M', '5', 'u/[a-z]', 't/\\w+'], ['a/tail\nend\n', 'X/.*end.*']]
+        text = file_get_contents(long_path) + '\n\nlast line. '
+        for argv in commands + self.mixed_commands:
+            args = ped.parse_args(argv)
+            expected = ped.get_string(args, ped.execute(args, ped.compile_commands(args), text))
+            self.assertEqual(self.run_piped(argv, text), expected)
+        text = 'one\ntwo\nthree\n\nfour five\nsix'
+        for argv, out in [(self.mixed_commands[0], 'top\nfour\nfive\nfour five\nsix\n'),
+                          (self.mixed_commands[1], 'one\ntwo\nthree\n\nfour five\nsix\nx\ny\n'),
+                          (self.mixed_commands[2], 'onehreeour five\n'),
+                          (self.mixed_commands[3], 'one\ntwo\nthree\nZ\nX\nsiX\n'),
+                          (['s/[aeiou]/-'], '-n-\ntw-\nthr--\n\nf--r f-v-\ns-x\n'),
+                          (['-M', '5', 'u/[a-z]', 't/\\w+'], 'One\nTwo\nThree\n\nFour Five\nsix\n')]:
+            with self.subTest(argv=argv):
+                self.assertEqual(self.run_piped(['-E', '\n'] + argv, text), out)
+
+
 class TestErrors(TestPed):
 
     def test_unknown_command(self):
@@ -468,6 +1638,17 @@ class TestErrors(TestPed):
             out = self.run_piped(['s/?/'], 'test')
         self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_RE_ERROR)
 
+    def test_template_error(self):
+        for argv in [['s/a/\\1/'], ['s/a+/\\2/'], ['-M', '1', 's/(a)/\\g<2>/'], ['S/a/\\1/']]:
+            with self.subTest(argv=argv):
+                with self.assertRaises(ped.PedError) as ex:
+                    self.run_piped(argv, 'xyz\n')
+                self.assertEqual(ex.exception.type, ped.PedErrorTypes.PED_RE_ERROR)
+        result = subprocess.run([sys.executable, os.path.join(tests_path, 'ped.py'), 's/a/\\1/'], input='xyz\n',
+                                capture_output=True, text=True)
+        self.assertEqual((result.returncode, result.stdout), (3, ''))
+        self.assertEqual(result.stderr, 'Error: regular expression invalid - invalid group reference 1 : "\\1"\n')
+
     def test_io_error(self):
         with self.assertRaises(ped.PedError) as ex:
             out = self.run_piped(['-f', '/home', 's/./-'], '')